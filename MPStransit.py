@@ -5,8 +5,11 @@
 # created 2017-04-04 (MPS), last modification 2017-04-05
 
 #import numpy
-from pylab import *
+# pylab is only imported when plotting, so the analysis can run without matplotlib
+from numpy import array, mean, seterr, sort, sqrt
 import re
+import period_search
+import log_rotation
 
 #seterr(all='warn')  # one message is prompted in the terminal, for an error occuring repeatedly there is no new message
 seterr(all='ignore') # nothing is prompted
@@ -20,7 +23,17 @@ YAXIS = 'Relative Helligkeit (%)'
 
 #### 1. DEFINE FUNCTION FOR PABLO ####
 
-def lightcurve_analyze(time, lightcurve, show_plot=False):  # where time and lightcurve must be arrays of the same dimension and length
+def lightcurve_analyze(time, lightcurve, show_plot=False, use_bls=False):  # where time and lightcurve must be arrays of the same dimension and length
+    period, depth, transit_mids, transit_midfluxes, lightcurve_norm = lightcurve_detect(time, lightcurve, use_bls)
+    if show_plot:
+        print_result(period, depth)
+        plot_lightcurve(time, lightcurve_norm, transit_mids, transit_midfluxes)
+    return period, depth, transit_mids
+
+
+def lightcurve_detect(time, lightcurve, use_bls=False):
+    # returns period, depth, transit mid-times and mid-fluxes and the normalized light curve, so the
+    # results can be printed and plotted again later
     
     # Define out-of-transit level
     lightcurve_outoftrans = ( mean( lightcurve[:3] ) + mean( lightcurve[-3:] )) / 2.
@@ -54,34 +67,46 @@ def lightcurve_analyze(time, lightcurve, show_plot=False):  # where time and lig
             lightcurvetrans_temp = []
             transit_flag = False
 
-    period = (transit_mids[-1] - transit_mids[0]) / (len(transit_mids)-1)
+    if use_bls or len(transit_mids) < 2:
+        # without two clean threshold crossings, search the period with Box Least Squares
+        search_result = period_search.bls(time, lightcurve_norm)
+        period = search_result.period
+        depth = search_result.depth
+        transit_mids = list(search_result.get_transit_times(time[0], time[-1]))
+        transit_midfluxes = [100. - depth] * len(transit_mids)
+    else:
+        period = (transit_mids[-1] - transit_mids[0]) / (len(transit_mids)-1)
+
+        depth = 100. - mean(transit_midfluxes)
+        
+    return period, depth, transit_mids, transit_midfluxes, lightcurve_norm
+
 
-    depth = 100. - mean(transit_midfluxes)
+def print_result(period, depth):
+    print("Transit Period =  {:3f} s".format(period))
+    print("Transit Depth  = {:1f} %".format(depth))
     
-    if show_plot:
-        print("Transit Period =  {:3f} s".format(period))
-        print("Transit Depth  = {:1f} %".format(depth))
-        
-        print("\n==> The planet has a radius that is {:3f} times the radius of the star.".format(sqrt(depth/100.)))
-        
-        figure(1)
-        clf()
-        plt1 = subplot(111)
-        plot(time, lightcurve_norm, color="black", label='Messungen')
-        plot(transit_mids, transit_midfluxes, '*', color="red", label='Tiefpunkte')
-
-        plt1.set_ylabel(YAXIS)
-        plt1.set_xlabel("Zeit (s)")
-        
-        legend = plt1.legend(loc='upper right')
-        # Set the fontsize
-        for label in legend.get_texts():
-            label.set_fontsize('small')
+    print("\n==> The planet has a radius that is {:3f} times the radius of the star.".format(sqrt(depth/100.)))
 
-        show()
-        draw()
-        
-    return period, depth, transit_mids
+
+def plot_lightcurve(time, lightcurve_norm, transit_mids, transit_midfluxes):
+    from pylab import clf, draw, figure, plot, show, subplot
+    figure(1)
+    clf()
+    plt1 = subplot(111)
+    plot(time, lightcurve_norm, color="black", label='Messungen')
+    plot(transit_mids, transit_midfluxes, '*', color="red", label='Tiefpunkte')
+
+    plt1.set_ylabel(YAXIS)
+    plt1.set_xlabel("Zeit (s)")
+    
+    legend = plt1.legend(loc='upper right')
+    # Set the fontsize
+    for label in legend.get_texts():
+        label.set_fontsize('small')
+
+    show()
+    draw()
 
 
 #### 2. LOAD EXAMPLE DATA ####
@@ -93,14 +118,17 @@ def get_sec(time_str):
 # the code for the main program shall be written inside a function called main
 # this is not mandatory but makes it much easier to use
 def main():
-    file_in = open("transit_cam.log", "r")
-#     file_in = open("transit_cam_002.log", "r")
-    lines_in = [line for line in file_in.readlines() if line[0] != '#']
+    # rotated and compressed segments of the log are read as well
+    lines_in = [line for line in log_rotation.read_lines("transit_cam.log") if line[0] != '#']
+#     lines_in = [line for line in log_rotation.read_lines("transit_cam_002.log") if line[0] != '#']
     
     # use list comprehension
     pattern = re.compile('[ \(\),\n]+')
     time = [get_sec(pattern.split(line)[1]) for line in lines_in]
-    brightness_R_list, brightness_G_list, brightness_B_list = zip(*[map(float, pattern.split(line)[2:5]) for line in lines_in])
+    # a monochrome log has a single luminance value per line, which is used for all three channels
+    brightness_R_list, brightness_G_list, brightness_B_list = zip(*[
+        map(float, pattern.split(line)[2:5]) if line.split()[2].startswith('(') else [float(line.split()[2])] * 3
+        for line in lines_in])
     
     # use different names for different entities
     brightness_R = array(brightness_R_list)
@@ -1,10 +1,41 @@
+import sys
+import csv
+import json
+import datetime
+import warnings
 import os.path as path
 from argparse import ArgumentParser
 
 import MPStransit
+import bootstrap as bootstrap_resampling
+import detrending
+import folding
+import log_index
+import log_rotation
+import profiling
+import result_cache
+import resampling
+import transit_fit
 import numpy
-from pylab import *
-from matplotlib.backends.backend_pdf import PdfPages
+from log_index import TIMESTAMP_LENGTH
+# pylab is only imported by the plotting functions, so the analysis can run without matplotlib
+from numpy import array, maximum, searchsorted, sqrt, unique
+
+# position and character of the separators in a timestamp like 2022-06-01 20:00:00.123456, all
+# other characters are digits
+TIMESTAMP_SEPARATORS = {4: b'-', 7: b'-', 10: b' ', 13: b':', 16: b':', 19: b'.'}
+
+
+def has_timestamp_layout(timestamps):
+    # True if all fixed width byte strings are laid out like TIMESTAMP_SEPARATORS. NumPy may crash
+    # instead of raising an error on malformed timestamps in large arrays, so they are checked
+    # before the conversion to datetime64
+    characters = timestamps.view(numpy.uint8).reshape(-1, TIMESTAMP_LENGTH)
+    separators = list(TIMESTAMP_SEPARATORS)
+    digits = numpy.delete(characters, separators, axis=1)
+    expected = numpy.frombuffer(b''.join(TIMESTAMP_SEPARATORS.values()), dtype=numpy.uint8)
+    return bool(numpy.all(characters[:, separators] == expected) and
+                numpy.all((digits >= ord('0')) & (digits <= ord('9'))))
 
 
 class LightPoint(object):
@@ -15,10 +46,20 @@ class LightPoint(object):
     @staticmethod
     def parse_line(line):
         parts = line.strip().split()
-        if len(parts) != 5:
+        # a tracked sample carries the applied ROI offset as two additional parts, a monochrome
+        # sample has a single luminance value instead of the three channels in parentheses
+        monochrome = len(parts) > 2 and not parts[2].startswith('(')
+        if len(parts) not in ((3, 5) if monochrome else (5, 7)):
+            return None
+        try:
+            # the fraction of the seconds is missing in older logs when it is zero
+            timestamp = datetime.datetime.fromisoformat(' '.join(parts[0:2]))
+            if monochrome:
+                value = array((float(parts[2]),))
+            else:
+                value = array((float(parts[2][1:-1]), float(parts[3][:-1]), float(parts[4][:-1])))
+        except ValueError:
             return None
-        timestamp = datetime.datetime.strptime(' '.join(parts[0:2])[:26], '%Y-%m-%d %H:%M:%S.%f')
-        value = array((float(parts[2][1:-1]), float(parts[3][:-1]), float(parts[4][:-1])))
         return LightPoint(timestamp, value)
         
     def time_diff(self, other):
@@ -28,172 +69,610 @@ class LightPoint(object):
         
 
 class LightCurve(object):
-    def __init__(self, points):
-        self.points = points
+    # the samples are kept as arrays sorted by timestamp, so time window queries are binary searches
+    # and the resulting curves share the arrays of the curve they were taken from
+    def __init__(self, points=None, timestamps=None, values=None):
+        if points is not None:
+            timestamps = numpy.array([point.timestamp for point in points], dtype='datetime64[us]')
+            values = numpy.array([point.value for point in points], dtype=float)
+        if len(timestamps) > 1 and numpy.any(timestamps[1:] < timestamps[:-1]):
+            order = numpy.argsort(timestamps, kind='stable')
+            timestamps, values = timestamps[order], values[order]
+        self.timestamps = timestamps
+        self.values = values
         self.first_point = None
         self.last_point = None
         self.update_duration()
 
+    @property
+    def points(self):
+        return [LightPoint(timestamp, value) for timestamp, value in zip(self.timestamps.astype(object), self.values)]
+
     def update_duration(self):
-        self.first_point = sorted(self.points, key=lambda v: v.timestamp)[0]
-        self.last_point = sorted(self.points, key=lambda v: v.timestamp)[-1]
+        if len(self.timestamps) == 0:
+            return
+        self.first_point = LightPoint(self.timestamps[0].astype(object), self.values[0])
+        self.last_point = LightPoint(self.timestamps[-1].astype(object), self.values[-1])
         
     def get_duration(self):
         return self.last_point.time_diff(self.first_point)
+
+    def get_times(self, reference=None):
+        # seconds since reference, which defaults to the first point
+        if reference is None:
+            reference = self.timestamps[0]
+        return (self.timestamps - numpy.datetime64(reference, 'us')) / numpy.timedelta64(1, 's')
         
     @staticmethod
-    def read(filename):
+    def read(filename, count=0):
+        # with a count, only the last count acquisitions are located through the index and parsed,
+        # rotated segments are read back to front and only as far as needed
+        if count > 0:
+            texts = []
+            for segment in reversed(log_rotation.get_segments(filename)):
+                index = log_index.LogIndex.load(segment)
+                texts = index.read_acquisitions(index.get_acquisitions()[len(texts) - count:]) + texts
+                if len(texts) >= count:
+                    break
+            lines = [line for text in texts for line in text.splitlines(True)]
+        else:
+            lines = list(log_rotation.read_lines(filename))
+        result = LightCurve.parse_lines(lines)
+        print(f'{len(result)} light curves read')
+        return result
+
+    @staticmethod
+    def parse_lines(lines):
+        # the diagnostics go to stderr, so they do not mix with a summary written to stdout
         result = []
-        with open(filename) as in_file:
-            current_curve = []
-            for i, line in enumerate(in_file.readlines()):
-                if line[0] == '#':
-                    if len(current_curve) > 0:
-                        result.append(LightCurve(current_curve))
-                        print(f'Creating light curve with {len(current_curve)} elements and '
-                              f'a duration of {result[-1].get_duration()}')
-                    current_curve = []
-                    continue
-                new_point = LightPoint.parse_line(line)
-                if new_point is None: 
-                    print('Unexpected number of parts on line {}'.format(i))
-                    continue
-                current_curve.append(new_point)                
-            if len(current_curve) > 0:
+        current_curve = []
+        for i, line in enumerate(lines):
+            if line[0] == '#':
+                if len(current_curve) > 0:
+                    result.append(LightCurve(current_curve))
+                    print(f'Creating light curve with {len(current_curve)} elements and '
+                          f'a duration of {result[-1].get_duration()}', file=sys.stderr)
+                current_curve = []
+                continue
+            new_point = LightPoint.parse_line(line)
+            if new_point is None: 
+                print('Unexpected line {}'.format(i), file=sys.stderr)
+                continue
+            if len(current_curve) > 0 and len(new_point.value) != len(current_curve[-1].value):
+                print('Number of values changes on line {}, starting a new light curve'.format(i), file=sys.stderr)
                 result.append(LightCurve(current_curve))
-                print(f'Creating light curve with {len(current_curve)} elements and '
-                      f'a duration of {result[-1].get_duration()}')
-        print(f'{len(result)} light curves read')
+                current_curve = []
+            current_curve.append(new_point)                
+        if len(current_curve) > 0:
+            result.append(LightCurve(current_curve))
+            print(f'Creating light curve with {len(current_curve)} elements and '
+                  f'a duration of {result[-1].get_duration()}', file=sys.stderr)
         return result
+
+    @staticmethod
+    def parse_block(content):
+        # parses the raw bytes of one acquisition with array operations, falling back to
+        # parse_lines for records that are not in the plain or the tracked layout
+        lines = [line for line in content.split(b'\n') if line.strip() and line[:1] != b'#']
+        if len(lines) == 0:
+            return []
+        # three channels in parentheses, or a single luminance value in monochrome mode
+        columns = 3 if lines[0][TIMESTAMP_LENGTH:].lstrip().startswith(b'(') else 1
+        timestamps = array([line[:TIMESTAMP_LENGTH] for line in lines], dtype='S{}'.format(TIMESTAMP_LENGTH))
+        values = None
+        if has_timestamp_layout(timestamps):
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    timestamps = timestamps.astype('datetime64[us]')
+                values = numpy.fromstring(b' '.join(line[TIMESTAMP_LENGTH:] for line in lines)
+                                          .translate(None, b'(),\r').decode(), sep=' ')
+            except ValueError:
+                values = None
+        if values is not None and len(values) == (columns + 2) * len(lines):
+            # tracked records end with the ROI offset (dx, dy), which is not part of the values
+            return [LightCurve(timestamps=timestamps, values=values.reshape(-1, columns + 2)[:, :columns])]
+        if values is None or len(values) != columns * len(lines):
+            return LightCurve.parse_lines(content.decode().splitlines(True))
+        return [LightCurve(timestamps=timestamps, values=values.reshape(-1, columns))]
+
+    def get_window(self, from_time, to_time):
+        # index range of the points with from_time <= timestamp < to_time
+        return tuple(numpy.searchsorted(self.timestamps, numpy.array([from_time, to_time], dtype='datetime64[us]')))
         
     def extract(self, from_time, to_time):
-        return LightCurve([point for point in self.points if from_time <= point.timestamp < to_time])
+        first, last = self.get_window(from_time, to_time)
+        return LightCurve(timestamps=self.timestamps[first:last], values=self.values[first:last])
         
     def split(self, separators):
-        result = []
-        new_curve = []
-        index = 0
-        for point in sorted(self.points, key=lambda v: v.timestamp):
-            if point.timestamp < separators[index]:
-                new_curve.append(point)
-            else:
-                if len(new_curve):
-                    result.append(LightCurve(new_curve))
-                    new_curve = []
-                index += 1
-                if index >= len(separators):
-                    break
-        if len(new_curve):
-            result.append(LightCurve(new_curve))
-        return result
+        # splits at each separator, points after the last separator are dropped
+        bounds = numpy.searchsorted(self.timestamps, numpy.array(separators, dtype='datetime64[us]'))
+        return [LightCurve(timestamps=self.timestamps[first:last], values=self.values[first:last])
+                for first, last in zip(numpy.concatenate(([0], bounds[:-1])), bounds) if last > first]
         
     def get_norm(self):
-        return numpy.mean([mean(point.value) for point in self.points[:3]+self.points[-3:]])
+        return numpy.concatenate((self.values[:3], self.values[-3:])).mean()
         
     def get_min(self):
-        return sorted([mean(point.value) for point in self.points])[2]
+        return numpy.sort(self.values.mean(axis=1))[2]
         
     def normalize(self):
-        return LightCurve([LightPoint(point.timestamp, 100.*point.value/self.get_norm()) for point in self.points])
+        return LightCurve(timestamps=self.timestamps, values=100. * self.values / self.get_norm())
         
     def get_transit_center(self):
-        threshold = (self.get_norm() + self.get_min()) / 2.
-        # mean_time = mean([point.time_diff(self.first_point)
-        #                   for point in self.points if mean(point.value) <= threshold])
-#         return self.first_point.timestamp+datetime.timedelta(seconds=mean_time)
-        
-        mean_time_obscuration = mean([point.time_diff(self.first_point)*(self.get_norm()-mean(point.value))
-                                      for point in self.points if mean(point.value) <= threshold])
-        mean_obscuration = self.get_norm()-mean([mean(point.value) for point in self.points if mean(point.value) <=
-                                                 threshold])
-        return self.first_point.timestamp+datetime.timedelta(seconds=mean_time_obscuration/mean_obscuration)
+        norm = self.get_norm()
+        threshold = (norm + self.get_min()) / 2.
+        brightness = self.values.mean(axis=1)
+        below = brightness <= threshold
+        times = self.get_times()
+        # each sample is weighted with the time it covers, so uneven frame intervals do not shift the center
+        durations = numpy.gradient(times) if len(times) > 1 else numpy.ones(len(times))
+        obscuration = (norm - brightness[below]) * durations[below]
+        mean_time = numpy.sum(times[below] * obscuration) / numpy.sum(obscuration)
+        return self.first_point.timestamp+datetime.timedelta(seconds=mean_time)
         
     def invert(self, timestamp):
-        return LightCurve([LightPoint(timestamp-(point.timestamp-timestamp), point.value) for point in self.points])    
+        timestamp = numpy.datetime64(timestamp, 'us')
+        return LightCurve(timestamps=timestamp - (self.timestamps - timestamp), values=self.values)
     
 
-def add_plot_info(an_axis, period, num_curves, depth):
+class LightCurveTail(object):
+    # follows the last acquisition of a growing log, parsing only the appended bytes
+    def __init__(self, filename, detrend=False):
+        self.filename = filename
+        self.detrend = detrend
+        self.sample_filter = detrending.StreamingFilter() if detrend else None
+        self.position = 0
+        self.pending = b''
+        self.first_timestamp = None
+        self.times = numpy.empty(4096)
+        self.values = numpy.empty(4096)
+        self.length = 0
+        acquisitions = log_index.LogIndex.load(filename).get_acquisitions()
+        if len(acquisitions):
+            self.position = acquisitions[-1].offset
+
+    def get_times(self):
+        return self.times[:self.length]
+
+    def get_values(self):
+        return self.values[:self.length]
+
+    def reset(self):
+        self.first_timestamp = None
+        self.length = 0
+        if self.detrend:
+            self.sample_filter = detrending.StreamingFilter()
+
+    def append(self, time, value):
+        if self.length == len(self.times):
+            self.times = numpy.resize(self.times, 2 * len(self.times))
+            self.values = numpy.resize(self.values, 2 * len(self.values))
+        self.times[self.length] = time
+        self.values[self.length] = value
+        self.length += 1
+
+    def poll(self):
+        # returns False if a new acquisition was started
+        if not path.isfile(self.filename):
+            return True
+        same_acquisition = True
+        if path.getsize(self.filename) < self.position:
+            # the log was replaced, start over
+            self.position = 0
+            self.pending = b''
+            self.reset()
+            same_acquisition = False
+        with open(self.filename, 'rb') as in_file:
+            in_file.seek(self.position)
+            data = in_file.read()
+        self.position += len(data)
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            text = line.decode(errors='replace')
+            if text.startswith('#'):
+                self.reset()
+                same_acquisition = False
+                continue
+            new_point = LightPoint.parse_line(text)
+            if new_point is None:
+                continue
+            if self.first_timestamp is None:
+                self.first_timestamp = new_point.timestamp
+            time, value = new_point.time_diff(self.first_timestamp), sum(new_point.value)
+            if self.sample_filter is not None:
+                # the filter releases each sample half a window later
+                released = self.sample_filter.add(time, value)
+                if released is None or not released[2]:
+                    continue
+                time, value = released[:2]
+            self.append(time, value)
+        return same_acquisition
+
+
+class TransitDetector(object):
+    # threshold transit detection as in MPStransit.lightcurve_analyze, applied only to the samples
+    # after the last completed transit. The threshold can only decrease, as it follows the lowest
+    # samples, so when it changes the completed transits can only shrink, split or vanish and only
+    # their samples are scanned again.
+    def __init__(self):
+        self.norm = None
+        self.lowest = numpy.empty(0)
+        self.threshold = None
+        self.scanned = 0
+        self.scan_start = 0
+        # the sample ranges of the completed transits
+        self.transit_starts = numpy.empty(0, dtype=int)
+        self.transit_ends = numpy.empty(0, dtype=int)
+        self.transit_mids = []
+        self.transit_midfluxes = []
+
+    def get_period(self):
+        if len(self.transit_mids) < 2:
+            return None
+        return (self.transit_mids[-1] - self.transit_mids[0]) / (len(self.transit_mids) - 1)
+
+    def get_depth(self):
+        return 100. - numpy.mean(self.transit_midfluxes) if len(self.transit_midfluxes) else None
+
+    def find_transits(self, values, first, last):
+        # start and end of the runs below the threshold in values[first:last]
+        below = values[first:last] < self.threshold
+        changes = numpy.diff(numpy.concatenate(([0], below.astype(numpy.int8), [0])))
+        return numpy.flatnonzero(changes == 1) + first, numpy.flatnonzero(changes == -1) + first
+
+    def add_transits(self, times, values, starts, ends):
+        self.transit_starts = numpy.concatenate((self.transit_starts, starts))
+        self.transit_ends = numpy.concatenate((self.transit_ends, ends))
+        for start, end in zip(starts, ends):
+            self.transit_mids.append(numpy.mean(times[start:end]))
+            self.transit_midfluxes.append(100. * numpy.min(values[start:end]) / self.norm)
+
+    def update(self, times, values):
+        # returns True if a new transit was completed
+        if len(values) < 6:
+            return False
+        if self.norm is None:
+            self.norm = numpy.mean(values[:3])
+        self.lowest = numpy.sort(numpy.concatenate((self.lowest, values[self.scanned:])))[:3]
+        self.scanned = len(values)
+        threshold = (self.norm + self.lowest[-1]) / 2.
+        if threshold != self.threshold:
+            self.threshold = threshold
+            # a run inside a completed transit is completed as well, the sample after the transit is
+            # above the previous and therefore above the new threshold
+            runs = [self.find_transits(values, start, end)
+                    for start, end in zip(self.transit_starts, self.transit_ends)]
+            self.transit_starts = self.transit_ends = numpy.empty(0, dtype=int)
+            self.transit_mids = []
+            self.transit_midfluxes = []
+            for starts, ends in runs:
+                self.add_transits(times, values, starts, ends)
+        starts, ends = self.find_transits(values, self.scan_start, len(values))
+        completed = ends < len(values)
+        self.add_transits(times, values, starts[completed], ends[completed])
+        # an unfinished transit is scanned again with the next samples
+        self.scan_start = starts[~completed][0] if numpy.any(~completed) else len(values)
+        return bool(numpy.any(completed))
+
+
+def follow_file(filename, planet_name=None, detrend=False, interval=1., window=60., **kwargs):
+    from pylab import figure, fignum_exists, ion, pause, subplot, subplots_adjust
+    print(f'Following file {filename} with name {planet_name}')
+    tail = LightCurveTail(filename, detrend)
+    detector = TransitDetector()
+    running_fold = folding.RunningFold()
+
+    ion()
+    fig = figure(1)
+    fig.clf()
+    fig.suptitle(f'Nacht des Wissens 2022 - {planet_name}')
+    curve_axis = subplot(211)
+    curve_line, = curve_axis.plot([], [], color='black', label='Messungen')
+    mids_line, = curve_axis.plot([], [], '*', color='red', label='Tiefpunkte')
+    curve_axis.set_ylabel(MPStransit.YAXIS)
+    curve_axis.set_xlabel('Zeit (s)')
+    folded_axis = subplot(212)
+    folded_line, = folded_axis.plot([], [], color='black')
+    folded_axis.set_title('Direkte Lichtkurve')
+    folded_axis.set_ylabel(MPStransit.YAXIS)
+    folded_axis.set_xlabel('Zeit nach Tiefpunkt (s)')
+    info_text = folded_axis.text(0.99, 0.01, '', size='xx-small', transform=folded_axis.transAxes,
+                                 horizontalalignment='right', verticalalignment='bottom')
+    subplots_adjust(hspace=0.4)
+
+    try:
+        while fignum_exists(fig.number):
+            if not tail.poll():
+                # samples of different acquisitions are neither detected nor folded together
+                detector = TransitDetector()
+                running_fold = folding.RunningFold()
+            times, values = tail.get_times(), tail.get_values()
+            if detector.update(times, values) or tail.length == 0:
+                mids = array(detector.transit_mids)
+                mids_line.set_data(mids, detector.transit_midfluxes)
+            if tail.length > 0 and detector.norm is not None:
+                # only the recent part of the light curve is shown, so drawing does not grow with the log
+                first = searchsorted(times, times[-1] - window)
+                curve_line.set_data(times[first:], 100. * values[first:] / detector.norm)
+                curve_axis.set_xlim(times[first], max(times[-1], times[first] + 1.))
+                curve_axis.relim()
+                curve_axis.autoscale_view(scalex=False)
+            period = detector.get_period()
+            if period is not None:
+                running_fold.update(times, values, period, detector.transit_mids[0], detector.norm)
+                folded_line.set_data(*running_fold.get_curve())
+                folded_axis.set_xlim(-period / 2., period / 2.)
+                folded_axis.relim()
+                folded_axis.autoscale_view(scalex=False)
+                depth = detector.get_depth()
+                info_text.set_text('n = {} Durchgaenge, T = {:5.2f} Sekunde, d = {:5.2f}%, r/R = {:5.3f}'.format(
+                    len(detector.transit_mids), period, depth, sqrt(max(depth, 0.) / 100.)))
+            pause(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def add_plot_info(an_axis, period, num_curves, depth, period_interval=None, depth_interval=None, confidence=None):
+    # the optional intervals are shown as confidence intervals next to the values
+    period_text = "T = {:5.2f} Sekunde".format(period)
+    depth_text = "d = {:5.2f}%".format(depth, sqrt(depth / 100.))
+    radius_text = "r/R = {:5.3f}".format(sqrt(depth / 100.))
+    if period_interval is not None:
+        period_text += " ({:.0f}%: {:5.2f} - {:5.2f})".format(100. * confidence, *period_interval)
+    if depth_interval is not None:
+        depth_text += " ({:.0f}%: {:5.2f} - {:5.2f})".format(100. * confidence, *depth_interval)
+        radius_text += " ({:.0f}%: {:5.3f} - {:5.3f})".format(100. * confidence,
+                                                              *sqrt(maximum(depth_interval, 0.) / 100.))
     an_axis.set_ylabel(MPStransit.YAXIS)
     an_axis.set_xlabel('Zeit nach Tiefpunkt (s)')
     an_axis.text(0.99, 0.16, "n = {} Durchgaenge".format(num_curves), size="xx-small",
                  transform=an_axis.transAxes, horizontalalignment="right", verticalalignment="bottom")
-    an_axis.text(0.99, 0.11, "T = {:5.2f} Sekunde".
-                 format(period),
+    an_axis.text(0.99, 0.11, period_text,
                  size="xx-small", horizontalalignment="right", transform=an_axis.transAxes, verticalalignment="bottom")
-    an_axis.text(0.99, 0.06, "d = {:5.2f}%".format(depth, sqrt(depth / 100.)),
+    an_axis.text(0.99, 0.06, depth_text,
                  size="xx-small", horizontalalignment="right", transform=an_axis.transAxes, verticalalignment="bottom")
-    an_axis.text(0.99, 0.01, "r/R = {:5.3f}".format(sqrt(depth / 100.)),
+    an_axis.text(0.99, 0.01, radius_text,
                  size="xx-small", horizontalalignment="right", transform=an_axis.transAxes, verticalalignment="bottom")
 
+
+def plot_folded(an_axis, offsets, values, period):
+    # all samples are drawn as a single artist, together with the binned curve
+    an_axis.plot(offsets, values, '.', markersize=1, alpha=0.3)
+    folded_curve = folding.bin_folded(offsets, values, period)
+    an_axis.fill_between(folded_curve.centers, folded_curve.mean - folded_curve.scatter,
+                         folded_curve.mean + folded_curve.scatter, color='gray', alpha=0.3, linewidth=0)
+    an_axis.plot(folded_curve.centers, folded_curve.median, color='black')
+
     
-def analyze_file(filename, no_pdf=False, count=1, planet_name=None, **kwargs):
-    print(f'Analyzing {count} light curves from file {filename} with name {planet_name} amd {"not " if no_pdf else ""}writing to PDF')
-    if not path.isfile(filename):
-        print('File {} not found. Aborting'.format(filename))
-        return
+def analyze_light_curve(light_curve, bls=False, detrend=False, fit=False, bootstrap=0, resample=False,
+                        profiler=profiling.DISABLED):
+    # returns the results as a dictionary of arrays, as they are stored in the result cache; everything
+    # printed is kept in the result, so print_analysis gives the same output for a cached result
+    result = dict()
+    with profiler.stage('cadence'):
+        times = light_curve.get_times()
+        values = light_curve.values.sum(axis=1)
+        # False for samples that only fill a gap of the uniform grid, they are left out of the fit and the fold
+        valid = numpy.ones(len(times), dtype=bool)
+        if resample:
+            # the values in gaps are interpolated across them, so the samples stay evenly spaced for the
+            # running median, the block bootstrap and the threshold detection, which count samples
+            resampled = resampling.resample(times, values)
+            times, values, valid = resampled.time, resampled.values, resampled.mask
+            report = resampled.report
+        else:
+            report = resampling.check_cadence(times)
+        result.update(cadence_report=str(report))
+    if detrend:
+        with profiler.stage('detrend'):
+            values, kept = detrending.detrend(times, values)
+            if resample:
+                # clipped samples are filled like the gaps, so the grid stays uniform
+                valid &= kept
+                values = resampling.fill_gaps(times, values, valid)
+            else:
+                times, values, valid = times[kept], values[kept], valid[kept]
+    with profiler.stage('lightcurve_analyze'):
+        period, depth, transit_centers, transit_fluxes, curve = MPStransit.lightcurve_detect(times, values, bls)
+    # the light curve plotted by plot_analysis, as MPStransit.lightcurve_analyze shows it
+    result.update(curve_times=times, curve_values=curve, detected_depth=depth,
+                  detected_centers=array(transit_centers, dtype=float),
+                  detected_fluxes=array(transit_fluxes, dtype=float))
+    if bootstrap > 0:
+        with profiler.stage('bootstrap'):
+            bootstrap_result = bootstrap_resampling.bootstrap(times, values, bootstrap, use_bls=bls)
+        result.update(period_interval=bootstrap_result.get_period_interval(),
+                      depth_interval=bootstrap_result.get_depth_interval(),
+                      confidence=bootstrap_result.confidence)
+    if fit:
+        with profiler.stage('fit'):
+            fit_result = transit_fit.fit_transits(times, values, transit_centers, period, valid)
+        # mean and error of each parameter, in the order of transit_fit.PARAMETERS
+        result.update(fitted=array([fit_result.get_mean(name) for name in transit_fit.PARAMETERS]))
+        depth = fit_result.get_mean('depth')[0]
+        transit_centers = fit_result.get_mid_times()
+    with profiler.stage('fold and normalize'):
+        offsets, cycles = folding.fold(times, transit_centers, period)
+        normalized = folding.normalize_cycles(values, cycles)
+        normalized[~valid] = numpy.nan
+        if not fit:
+            offsets = folding.center_cycles(offsets, cycles, normalized, 100. - depth / 2.)
+    result.update(timestamps=light_curve.timestamps, values=light_curve.values, period=period, depth=depth,
+                  transit_centers=array(transit_centers, dtype=float), offsets=offsets, cycles=cycles,
+                  normalized=normalized)
+    return result
 
-    light_curves = list(reversed(LightCurve.read(filename)))
-    if count > 0:
-        light_curves = light_curves[:count]
-    for light_curve in light_curves:
-        times = [point.time_diff(light_curve.first_point) for point in light_curve.points]
-        values = [sum(point.value) for point in light_curve.points]
-        period, depth, transit_centers = MPStransit.lightcurve_analyze(array(times), array(values), True)
-        clipped_curves = []
-        for transit_center in transit_centers:
-            clipped_curve = light_curve.extract(light_curve.first_point.timestamp +
-                                                datetime.timedelta(seconds=transit_center - period / 2.),
-                                                light_curve.first_point.timestamp +
-                                                datetime.timedelta(seconds=transit_center + period / 2.))
-            clipped_curves.append(clipped_curve.normalize())
-
-        print(len(clipped_curves))
-
-        fig = figure(1, dpi=400)
-        fig.set_size_inches((8.27, 11.69))
-        fig.clf()
-        fig.suptitle(f'Nacht des Wissens 2022 - {planet_name}')
-#         plt1 = subplot(111)
-        plt1 = subplot(211)
-        for clipped_curve in clipped_curves[0::2]:
-            transit_center = clipped_curve.get_transit_center()
-            curve_time = [point.time_diff(transit_center) for point in clipped_curve.points]
-            light_curve_points = [mean(point.value) for point in clipped_curve.points]
-            plot(curve_time, light_curve_points)
-        for clipped_curve in clipped_curves[1::2]:
-            transit_center = clipped_curve.get_transit_center()
-            curve_time = [point.time_diff(transit_center) for point in clipped_curve.invert(transit_center).points]
-            light_curve_points = [mean(point.value) for point in clipped_curve.points]
-            plot(curve_time, light_curve_points)
-        plt1.set_title('Gespiegelte Lichtkurve')
-        add_plot_info(gca(), period, len(light_curves), depth)
-        
-        plt1 = subplot(212)
-        for clipped_curve in clipped_curves:
-            transit_center = clipped_curve.get_transit_center()
-            curve_time = [point.time_diff(transit_center) for point in clipped_curve.points]
-            light_curve_points = [mean(point.value) for point in clipped_curve.points]
-            plot(curve_time, light_curve_points)
-        plt1.set_title('Direkte Lichtkurve')
-        current_axis = gca()
-        add_plot_info(current_axis, period, len(light_curves), depth)
-        
-        # add timestamp at the bottom right
-        figtext(0.99, 0.01, light_curve.first_point.timestamp.strftime("%Y-%m-%dT%H:%M:%S"),
-                size="xx-small", horizontalalignment="right")
 
-        if no_pdf is False:
+def print_analysis(result):
+    print(result['cadence_report'])
+    MPStransit.print_result(float(result['period']), float(result['detected_depth']))
+    if 'period_interval' in result:
+        print('Bootstrap interval of the period: {:.3f} - {:.3f} s'.format(*result['period_interval']))
+        print('Bootstrap interval of the depth: {:.3f} - {:.3f} %'.format(*result['depth_interval']))
+    if 'fitted' in result:
+        for name, (mean, error) in zip(transit_fit.PARAMETERS, result['fitted']):
+            if name != 'mid_time':
+                print('Fitted {:8s} = {:.4f} +/- {:.4f}'.format(name, mean, error))
+
+
+def plot_analysis(result, planet_name, num_curves, no_pdf=False, profiler=profiling.DISABLED):
+    # returns the name of the PDF file written, if any
+    with profiler.stage('lightcurve plot'):
+        MPStransit.plot_lightcurve(result['curve_times'], result['curve_values'], result['detected_centers'],
+                                   result['detected_fluxes'])
+    with profiler.stage('plot'):
+        figure = plot_result(result, planet_name, num_curves)
+    filename = None
+    if no_pdf is False:
+        from matplotlib.backends.backend_pdf import PdfPages
+        first_timestamp = result['timestamps'][0].astype(object)
+        with profiler.stage('pdf'):
             try:
-                filename = light_curve.first_point.timestamp.strftime(
+                filename = first_timestamp.strftime(
                     'Nacht des Wissens 2022 - %Y_%m_%d_%H_%M_%S.pdf')
                 pdf = PdfPages(filename)
-                savefig(pdf, format="pdf")
+                figure.savefig(pdf, format="pdf")
                 pdf.close()
             except PermissionError:
                 print('File {} is in use'.format(filename))
+                filename = None
+    with profiler.stage('show'):
+        from pylab import draw, show, subplots_adjust
         subplots_adjust(hspace=0.4)
         show()
         draw()
+    return filename
+
+
+def plot_result(result, planet_name, num_curves):
+    from pylab import figtext, figure, gca, subplot
+    period, depth = float(result['period']), float(result['depth'])
+    offsets, cycles, normalized = result['offsets'], result['cycles'], result['normalized']
+    intervals = dict((key, result[key]) for key in ('period_interval', 'depth_interval', 'confidence')
+                     if key in result)
+    if 'fitted' in result:
+        # the bootstrap interval belongs to the threshold depth, not to the fitted one
+        intervals.pop('depth_interval', None)
+    first_timestamp = result['timestamps'][0].astype(object)
+    in_transit_window = cycles >= 0
+
+    print(len(unique(cycles[in_transit_window])))
+
+    fig = figure(1, dpi=400)
+    fig.set_size_inches((8.27, 11.69))
+    fig.clf()
+    fig.suptitle(f'Nacht des Wissens 2022 - {planet_name}')
+#     plt1 = subplot(111)
+    plt1 = subplot(211)
+    plot_folded(plt1, folding.mirror(offsets, cycles)[in_transit_window], normalized[in_transit_window], period)
+    plt1.set_title('Gespiegelte Lichtkurve')
+    add_plot_info(gca(), period, num_curves, depth, **intervals)
+    
+    plt1 = subplot(212)
+    plot_folded(plt1, offsets[in_transit_window], normalized[in_transit_window], period)
+    plt1.set_title('Direkte Lichtkurve')
+    current_axis = gca()
+    add_plot_info(current_axis, period, num_curves, depth, **intervals)
+    
+    # add timestamp at the bottom right
+    figtext(0.99, 0.01, first_timestamp.strftime("%Y-%m-%dT%H:%M:%S"),
+            size="xx-small", horizontalalignment="right")
+    return fig
+
+    
+def analyze_file(filename, no_pdf=False, count=1, planet_name=None, bls=False, detrend=False, fit=False, bootstrap=0,
+                 resample=False, no_cache=False, profile=False, **kwargs):
+    print(f'Analyzing {count} light curves from file {filename} with name {planet_name} '
+          f'amd {"not " if no_pdf else ""}writing to PDF')
+    if len(log_rotation.get_segments(filename)) == 0:
+        print('File {} not found. Aborting'.format(filename))
+        return
+
+    profiler = profiling.Profiler() if profile else profiling.DISABLED
+    profiler.start()
+    with profiler.stage('index'):
+        entries = list(reversed(log_rotation.get_acquisitions(filename)))
+    if count > 0:
+        entries = entries[:count]
+    parameters = dict(bls=bls, detrend=detrend, fit=fit, bootstrap=bootstrap, resample=resample)
+    cache = None if no_cache else result_cache.ResultCache()
+    pdf_filename = None
+    # entries of the same segment are read together, so compressed segments are decompressed once
+    contents = log_rotation.read_acquisitions(entries)
+    for index, entry in entries:
+        with profiler.stage('read'):
+            content = next(contents)
+        # the analysis is only repeated if the acquisition or the parameters changed
+        with profiler.stage('cache'):
+            key = result_cache.ResultCache.get_key(content, parameters)
+            result = cache.get(key) if cache is not None else None
+        if result is None:
+            with profiler.stage('parse'):
+                light_curves = LightCurve.parse_block(content)
+            if len(light_curves) == 0:
+                continue
+            result = analyze_light_curve(light_curves[0], profiler=profiler, **parameters)
+            if cache is not None:
+                with profiler.stage('cache'):
+                    cache.put(key, **result)
+        else:
+            print('Using cached analysis of the light curve starting at {}'.format(result['timestamps'][0]))
+        print_analysis(result)
+        pdf_filename = plot_analysis(result, planet_name, len(entries), no_pdf, profiler) or pdf_filename
+    profiler.stop()
+    if profile:
+        profiler.report()
+        # next to the last PDF, so the numbers stay with the plots they were measured for
+        profile_filename = path.splitext(pdf_filename or path.basename(filename))[0] + '.profile.json'
+        profiler.write_json(profile_filename)
+        print('Profile written to {}'.format(profile_filename))
+
+
+SUMMARY_FIELDS = ('file', 'acquisition', 'start', 'samples', 'duration', 'cadence', 'jitter', 'gaps', 'transits',
+                  'period', 'depth', 'radius_ratio')
+
+
+def summarize_light_curve(light_curve):
+    # the estimate of MPStransit.lightcurve_analyze, computed with array operations and without plotting
+    times = light_curve.get_times()
+    values = light_curve.values.sum(axis=1)
+    report = resampling.check_cadence(times)
+    # with fewer than two threshold transits, analyze_batch falls back to the BLS search
+    periods, depths, transits = bootstrap_resampling.analyze_batch(times, values[numpy.newaxis, :])
+    period, depth, transit_count = float(periods[0]), float(depths[0]), int(transits[0])
+    return dict(start=str(light_curve.timestamps[0]), samples=len(times), duration=float(times[-1]),
+                cadence=report.cadence, jitter=report.jitter, gaps=report.get_gap_count(), transits=transit_count,
+                period=period, depth=depth,
+                radius_ratio=float(sqrt(max(depth, 0.) / 100.)))
+
+
+def summarize_files(filenames, output='-'):
+    # writes one row per acquisition as CSV, or as JSON lines if the output ends with .json or .jsonl
+    out_file = sys.stdout if output == '-' else open(output, 'w', newline='')
+    as_json = output.endswith('.json') or output.endswith('.jsonl')
+    writer = None if as_json else csv.DictWriter(out_file, SUMMARY_FIELDS)
+    if writer is not None:
+        writer.writeheader()
+    try:
+        for filename in filenames:
+            if len(log_rotation.get_segments(filename)) == 0:
+                print('File {} not found'.format(filename), file=sys.stderr)
+                continue
+            # one acquisition at a time in a single pass, so the memory use does not grow with the file
+            for number, (index, entry, content) in enumerate(log_rotation.iter_acquisitions(filename)):
+                light_curves = LightCurve.parse_block(content)
+                if len(light_curves) == 0:
+                    continue
+                row = dict(file=filename, acquisition=number, **summarize_light_curve(light_curves[0]))
+                if as_json:
+                    out_file.write(json.dumps(row) + '\n')
+                else:
+                    writer.writerow(row)
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
 
 
 def main():
@@ -202,13 +681,54 @@ def main():
     parser.add_argument('-np', '--no_pdf', action='store_true', help='skip PDF export')
     parser.add_argument('-c', '--count', action='store', type=int, default=1,
                         help='number of light curves to analyze (0 for all)')
+    parser.add_argument('-b', '--bls', action='store_true',
+                        help='determine period and depth with a Box Least Squares period search')
+    parser.add_argument('-d', '--detrend', action='store_true',
+                        help='reject outliers and remove a slow baseline before the analysis')
+    parser.add_argument('-r', '--resample', action='store_true',
+                        help='interpolate onto a uniform time grid and leave out gaps before the analysis')
+    parser.add_argument('--fit', action='store_true',
+                        help='fit a transit model to each transit for depth and mid-times with uncertainties')
+    parser.add_argument('--bootstrap', action='store', type=int, default=0, metavar='N',
+                        help='estimate confidence intervals of period and depth from N bootstrap resamples')
+    parser.add_argument('--no_cache', action='store_true', help='analyze again instead of using cached results')
+    parser.add_argument('-s', '--summary', action='store', type=str, nargs='?', const='-', metavar='OUTPUT',
+                        help='write period, depth, r/R and transit count of all acquisitions as CSV '
+                             '(JSON lines for .json) without plotting')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='follow the last acquisition of the file while it is written')
     parser.add_argument('-n', '--planet_name', action='store', type=str, help='name of the planet', default='MPS')
+    parser.add_argument('--profile', action='store_true',
+                        help='report time and peak memory of each stage of the analysis, without the result cache '
+                             '(tracemalloc slows it down)')
+    parser.add_argument('--cprofile', action='store', type=str, metavar='FILE',
+                        help='write cProfile statistics of the analysis to FILE, without the result cache')
 
     args = parser.parse_args()
+    if args.profile or args.cprofile is not None:
+        # a cached result would leave the analysis stages out of the profile
+        args.no_cache = True
 
     my_kwargs = vars(args)
-    for filename in args.files:
-        analyze_file(filename, **my_kwargs)
+    if args.summary is not None:
+        summarize_files(args.files, args.summary)
+        return
+    if args.follow:
+        if len(args.files) > 1:
+            parser.error('--follow takes a single file')
+        follow_file(args.files[0], **my_kwargs)
+        return
+    if args.cprofile is not None:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        for filename in args.files:
+            analyze_file(filename, **my_kwargs)
+    finally:
+        if args.cprofile is not None:
+            profile.disable()
+            profile.dump_stats(args.cprofile)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+# bootstrap.py
+# Confidence intervals for the period and depth determined by MPStransit.lightcurve_analyze.
+# Resampled light curves are built from a smoothed model plus residuals drawn in blocks, and the
+# threshold transit detection of lightcurve_analyze is repeated on all resamples of a batch at
+# once. Batches are distributed over a process pool; each batch has its own seed derived from a
+# single seed, so the result does not depend on the number of processes.
+
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+
+import detrending
+import period_search
+
+DEFAULT_RESAMPLES = 1000
+DEFAULT_SEED = 0
+DEFAULT_CONFIDENCE = 0.95
+# resamples generated and analyzed together by one task
+BATCH_SIZE = 100
+# residuals are drawn in blocks of this many consecutive samples to keep their correlation
+BLOCK_LENGTH = 30
+# window of the running median used as model of the light curve
+MODEL_WINDOW = 15
+
+
+class BootstrapResult(object):
+    def __init__(self, periods, depths, confidence):
+        self.periods = periods
+        self.depths = depths
+        self.confidence = confidence
+
+    def get_interval(self, samples):
+        tail = 50. * (1. - self.confidence)
+        return tuple(numpy.nanpercentile(samples, (tail, 100. - tail)))
+
+    def get_period_interval(self):
+        return self.get_interval(self.periods)
+
+    def get_depth_interval(self):
+        return self.get_interval(self.depths)
+
+
+def analyze_batch(time, lightcurves, use_bls=False):
+    # the threshold detection of MPStransit.lightcurve_analyze for each row of lightcurves,
+    # returns the period, the depth and the number of transits of each row. As in lightcurve_analyze,
+    # rows with fewer than two transits, or all rows with use_bls, are analyzed by the BLS search.
+    count, length = lightcurves.shape
+    out_of_transit = (lightcurves[:, :3].mean(axis=1) + lightcurves[:, -3:].mean(axis=1)) / 2.
+    normalized = 100. / out_of_transit[:, numpy.newaxis] * lightcurves
+    threshold = 50. + numpy.partition(normalized, 2, axis=1)[:, 2] / 2.
+
+    below = numpy.zeros((count, length + 2), dtype=numpy.int8)
+    below[:, 1:-1] = normalized < threshold[:, numpy.newaxis]
+    changes = numpy.diff(below, axis=1)
+    rows, starts = numpy.nonzero(changes == 1)
+    _, ends = numpy.nonzero(changes == -1)
+    # a transit still running at the end of the light curve is not counted
+    completed = ends < length
+    rows, starts, ends = rows[completed], starts[completed], ends[completed]
+
+    flat_starts, flat_ends = rows * length + starts, rows * length + ends
+    time_sums = numpy.concatenate(([0.], numpy.cumsum(numpy.tile(time, count))))
+    mids = (time_sums[flat_ends] - time_sums[flat_starts]) / (ends - starts)
+    bounds = numpy.empty(2 * len(flat_starts), dtype=numpy.intp)
+    bounds[0::2], bounds[1::2] = flat_starts, flat_ends
+    minima = numpy.minimum.reduceat(normalized.ravel(), bounds)[0::2] if len(bounds) else numpy.empty(0)
+
+    transits = numpy.bincount(rows, minlength=count)
+    last = numpy.cumsum(transits) - 1
+    first = last - transits + 1
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        valid = transits >= 2
+        periods = numpy.full(count, numpy.nan)
+        periods[valid] = (mids[last[valid]] - mids[first[valid]]) / (transits[valid] - 1)
+        depths = 100. - numpy.bincount(rows, minima, minlength=count) / transits
+    for row in numpy.flatnonzero(~valid | use_bls):
+        search_result = period_search.bls(time, normalized[row])
+        periods[row], depths[row] = search_result.period, search_result.depth
+        transits[row] = len(search_result.get_transit_times(time[0], time[-1]))
+    return periods, depths, transits
+
+
+def resample_batch(time, model, residuals, count, seed, use_bls=False):
+    generator = numpy.random.default_rng(seed)
+    length = len(residuals)
+    blocks = -(-length // BLOCK_LENGTH)
+    block_starts = generator.integers(0, max(length - BLOCK_LENGTH, 0) + 1, size=(count, blocks))
+    index = (block_starts[:, :, numpy.newaxis] + numpy.arange(min(BLOCK_LENGTH, length))).reshape(count, -1)
+    lightcurves = model + residuals[index[:, :length]]
+    return analyze_batch(time, lightcurves, use_bls)[:2]
+
+
+def bootstrap(time, lightcurve, resamples=DEFAULT_RESAMPLES, seed=DEFAULT_SEED, confidence=DEFAULT_CONFIDENCE,
+              processes=None, use_bls=False):
+    # use_bls has to match the analysis the intervals are reported for
+    time = numpy.asarray(time, dtype=float)
+    lightcurve = numpy.asarray(lightcurve, dtype=float)
+    model = detrending.running_median(lightcurve, MODEL_WINDOW)
+    residuals = lightcurve - model
+
+    counts = [min(BATCH_SIZE, resamples - start) for start in range(0, resamples, BATCH_SIZE)]
+    seeds = numpy.random.SeedSequence(seed).spawn(len(counts))
+    arguments = ([time] * len(counts), [model] * len(counts), [residuals] * len(counts), counts, seeds,
+                 [use_bls] * len(counts))
+    if processes == 1 or len(counts) == 1:
+        results = list(map(resample_batch, *arguments))
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(resample_batch, *arguments))
+    periods = numpy.concatenate([result[0] for result in results])
+    depths = numpy.concatenate([result[1] for result in results])
+    return BootstrapResult(periods, depths, confidence)
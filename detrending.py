@@ -0,0 +1,184 @@
+# detrending.py
+# Preprocessing of light curves before the transit analysis: running median and MAD, sigma
+# clipping of single-frame glitches and removal of a slow baseline (e.g. lamp drift) fitted
+# outside the transits. The running statistics are available offline, vectorized over whole
+# arrays, and as a streaming filter that is fed one sample at a time.
+
+import heapq
+import bisect
+import collections
+import numpy
+
+DEFAULT_WINDOW = 51
+DEFAULT_SIGMA = 5.
+# scales the median absolute deviation to the standard deviation of normally distributed values
+MAD_TO_SIGMA = 1.4826
+
+
+def running_median(values, window=DEFAULT_WINDOW):
+    # centered running median, the array is extended at both ends by reflecting it. The window is
+    # kept sorted: each step finds the leaving and the entering sample by binary search, so no
+    # window is sorted again.
+    values = numpy.asarray(values, dtype=float)
+    half = window // 2
+    if len(values) <= half:
+        return numpy.full(len(values), numpy.median(values))
+    padded = numpy.pad(values, half, mode='reflect').tolist()
+    current = sorted(padded[:window])
+    lower, upper = (window - 1) // 2, window // 2
+    result = numpy.empty(len(values))
+    for i in range(len(values)):
+        result[i] = (current[lower] + current[upper]) / 2.
+        if i + window < len(padded):
+            del current[bisect.bisect_left(current, padded[i])]
+            bisect.insort(current, padded[i + window])
+    return result
+
+
+def running_mad(values, window=DEFAULT_WINDOW, median=None):
+    if median is None:
+        median = running_median(values, window)
+    return MAD_TO_SIGMA * running_median(numpy.abs(numpy.asarray(values, dtype=float) - median), window)
+
+
+def sigma_clip(values, window=DEFAULT_WINDOW, sigma=DEFAULT_SIGMA):
+    # returns a mask of the samples within sigma robust standard deviations of the running median
+    values = numpy.asarray(values, dtype=float)
+    median = running_median(values, window)
+    scatter = running_mad(values, window, median)
+    return numpy.abs(values - median) <= sigma * numpy.maximum(scatter, numpy.finfo(float).tiny)
+
+
+def fit_baseline(time, values, out_of_transit, degree=2, knots=0):
+    # least squares fit of a polynomial, or with knots a cubic spline, to the out-of-transit samples
+    time = numpy.asarray(time, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    scale = max(numpy.ptp(time), numpy.finfo(float).tiny)
+    x = (time - time[0]) / scale
+    if knots > 0:
+        knot_positions = numpy.linspace(0., 1., knots + 2)[1:-1]
+        design = numpy.hstack((numpy.vander(x, 4, increasing=True),
+                               numpy.maximum(x[:, numpy.newaxis] - knot_positions, 0.) ** 3))
+    else:
+        design = numpy.vander(x, degree + 1, increasing=True)
+    coefficients, _, _, _ = numpy.linalg.lstsq(design[out_of_transit], values[out_of_transit], rcond=None)
+    return design @ coefficients
+
+
+def find_dips(values, sigma=3.):
+    # samples clearly below the typical level, used as transit mask when none is known yet
+    median = numpy.median(values)
+    scatter = MAD_TO_SIGMA * numpy.median(numpy.abs(values - median))
+    return values < median - sigma * scatter
+
+
+def detrend(time, values, transit_mask=None, window=DEFAULT_WINDOW, sigma=DEFAULT_SIGMA, degree=2, knots=0):
+    # returns the light curve divided by its baseline in percent and the mask of the kept samples;
+    # transit_mask marks the samples in transit, which are excluded from the baseline fit
+    time = numpy.asarray(time, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    kept = sigma_clip(values, window, sigma)
+    if transit_mask is None:
+        transit_mask = find_dips(values)
+    out_of_transit = kept & ~transit_mask
+    baseline = fit_baseline(time, values, out_of_transit, degree, knots)
+    return 100. * values / baseline, kept
+
+
+class RunningMedian(object):
+    # streaming median over the last window samples, using two heaps with lazy deletion so that
+    # each sample costs O(log window)
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.index = 0
+        # max heap (negated values) of the lower half and min heap of the upper half, entries are
+        # (value, index); the sizes only count the samples still inside the window
+        self.lower = []
+        self.upper = []
+        self.lower_size = 0
+        self.upper_size = 0
+        # for each sample inside the window, whether it is in the lower half
+        self.in_lower = {}
+
+    def prune(self, heap):
+        first_valid = self.index - self.window
+        if len(heap) > 2 * self.window:
+            heap[:] = [entry for entry in heap if entry[1] >= first_valid]
+            heapq.heapify(heap)
+        while heap and heap[0][1] < first_valid:
+            heapq.heappop(heap)
+
+    def move(self, source, target, to_lower):
+        value, index = heapq.heappop(source)
+        heapq.heappush(target, (-value, index))
+        self.in_lower[index] = to_lower
+
+    def balance(self):
+        self.prune(self.lower)
+        self.prune(self.upper)
+        if self.lower_size > self.upper_size + 1:
+            self.move(self.lower, self.upper, False)
+            self.lower_size -= 1
+            self.upper_size += 1
+        elif self.upper_size > self.lower_size:
+            self.move(self.upper, self.lower, True)
+            self.upper_size -= 1
+            self.lower_size += 1
+        self.prune(self.lower)
+        self.prune(self.upper)
+
+    def add(self, value):
+        # the sample leaving the window stays in its heap until it reaches the top
+        expired = self.index - self.window
+        if expired in self.in_lower:
+            if self.in_lower.pop(expired):
+                self.lower_size -= 1
+            else:
+                self.upper_size -= 1
+        self.index += 1
+        self.prune(self.lower)
+        if self.lower and value <= -self.lower[0][0]:
+            heapq.heappush(self.lower, (-value, self.index - 1))
+            self.in_lower[self.index - 1] = True
+            self.lower_size += 1
+        else:
+            heapq.heappush(self.upper, (value, self.index - 1))
+            self.in_lower[self.index - 1] = False
+            self.upper_size += 1
+        self.balance()
+        self.balance()
+        return self.get_median()
+
+    def get_median(self):
+        if self.lower_size > self.upper_size:
+            return -self.lower[0][0]
+        return (-self.lower[0][0] + self.upper[0][0]) / 2.
+
+
+class StreamingFilter(object):
+    # streaming counterpart of sigma_clip. Each sample is compared with the median of the window
+    # centered on it, so the decision is delayed by half a window. The scatter is estimated from
+    # the differences of consecutive samples, which the level change of a transit hardly affects.
+    def __init__(self, window=DEFAULT_WINDOW, sigma=DEFAULT_SIGMA):
+        self.window = window
+        self.sigma = sigma
+        self.median = RunningMedian(window)
+        self.difference = RunningMedian(window)
+        self.pending = collections.deque()
+        self.last_value = None
+
+    def add(self, time, value):
+        # returns time, value and whether it is kept for the sample half a window earlier,
+        # or None while the window is filled
+        self.median.add(value)
+        if self.last_value is not None:
+            self.difference.add(abs(value - self.last_value))
+        self.last_value = value
+        self.pending.append((time, value))
+        if len(self.pending) <= self.window // 2:
+            return None
+        time, value = self.pending.popleft()
+        if self.difference.index == 0:
+            return time, value, True
+        scatter = MAD_TO_SIGMA / numpy.sqrt(2.) * self.difference.get_median()
+        return time, value, abs(value - self.median.get_median()) <= self.sigma * max(scatter, numpy.finfo(float).tiny)
@@ -0,0 +1,147 @@
+# folding.py
+# Phase folding and binning of light curves. Every sample is assigned to its transit in one
+# vectorized pass, so the work grows with the number of samples and not with the number of
+# transits or combined acquisitions.
+
+import warnings
+
+import numpy
+
+DEFAULT_BINS = 100
+# number of samples at the start and the end of each transit window used for normalization
+EDGE_SAMPLES = 3
+
+
+class FoldedCurve(object):
+    def __init__(self, centers, counts, mean, median, scatter):
+        self.centers = centers
+        self.counts = counts
+        self.mean = mean
+        self.median = median
+        self.scatter = scatter
+
+
+def fold(time, transit_centers, period):
+    # returns the time of each sample relative to its nearest transit center and the index of that
+    # transit; samples more than half a period away from any transit get the index -1
+    time = numpy.asarray(time, dtype=float)
+    centers = numpy.sort(numpy.asarray(transit_centers, dtype=float))
+    if len(centers) == 0:
+        return numpy.zeros(len(time)), numpy.full(len(time), -1)
+    cycles = numpy.searchsorted((centers[1:] + centers[:-1]) / 2., time)
+    offsets = time - centers[cycles]
+    cycles[(offsets < -period / 2.) | (offsets >= period / 2.)] = -1
+    return offsets, cycles
+
+
+def fold_ephemeris(time, period, epoch):
+    time = numpy.asarray(time, dtype=float)
+    cycles = numpy.floor((time - epoch) / period + 0.5).astype(int)
+    offsets = time - (epoch + cycles * period)
+    return offsets, cycles
+
+
+def mirror(offsets, cycles):
+    # every second transit is reversed in time, as in the mirrored light curve
+    return numpy.where(cycles % 2 == 1, -offsets, offsets)
+
+
+def get_cycle_ranges(cycles):
+    # the samples are ordered in time, so the samples of each transit are contiguous
+    used = numpy.flatnonzero(cycles >= 0)
+    if len(used) == 0:
+        return used, used
+    cycle_numbers = numpy.arange(cycles.max() + 1)
+    starts = used[numpy.minimum(numpy.searchsorted(cycles[used], cycle_numbers), len(used) - 1)]
+    ends = used[numpy.maximum(numpy.searchsorted(cycles[used], cycle_numbers, side='right') - 1, 0)] + 1
+    return starts, ends
+
+
+def normalize_cycles(values, cycles, edge_samples=EDGE_SAMPLES):
+    # scales each transit to 100 percent, using the first and last samples of its window; samples
+    # that are NaN are left out of the norm
+    values = numpy.asarray(values, dtype=float)
+    result = numpy.full(len(values), numpy.nan)
+    used = cycles >= 0
+    if not numpy.any(used):
+        return result
+    starts, ends = get_cycle_ranges(cycles)
+    steps = numpy.arange(edge_samples)
+    edges = numpy.hstack((numpy.minimum(starts[:, numpy.newaxis] + steps, ends[:, numpy.newaxis] - 1),
+                          numpy.maximum(ends[:, numpy.newaxis] - edge_samples + steps, starts[:, numpy.newaxis])))
+    with warnings.catch_warnings():
+        # a transit without any finite edge sample gets a NaN norm
+        warnings.simplefilter('ignore', RuntimeWarning)
+        norms = numpy.nanmean(values[edges], axis=1)
+    result[used] = 100. * values[used] / norms[cycles[used]]
+    return result
+
+
+def center_cycles(offsets, cycles, normalized, threshold):
+    # shifts each transit onto its obscuration-weighted center, considering samples below threshold
+    used = (cycles >= 0) & (normalized <= threshold)
+    obscuration = numpy.where(used, 100. - normalized, 0.)
+    cycle_count = cycles.max() + 1 if numpy.any(cycles >= 0) else 0
+    index = numpy.where(used, cycles, 0)
+    weights = numpy.bincount(index, obscuration, minlength=cycle_count)
+    shifts = numpy.bincount(index, obscuration * offsets, minlength=cycle_count)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        shifts = numpy.where(weights > 0., shifts / weights, 0.)
+    return numpy.where(cycles >= 0, offsets - shifts[numpy.maximum(cycles, 0)], offsets)
+
+
+def bin_folded(offsets, values, period, bins=DEFAULT_BINS):
+    offsets = numpy.asarray(offsets, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    used = numpy.isfinite(offsets) & numpy.isfinite(values)
+    edges = numpy.linspace(-period / 2., period / 2., bins + 1)
+    index = numpy.searchsorted(edges, offsets[used], side='right') - 1
+    inside = (index >= 0) & (index < bins)
+    index, binned_values = index[inside], values[used][inside]
+
+    counts = numpy.bincount(index, minlength=bins)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean = numpy.bincount(index, binned_values, minlength=bins) / counts
+        variance = numpy.bincount(index, binned_values ** 2, minlength=bins) / counts - mean ** 2
+    scatter = numpy.sqrt(numpy.maximum(variance, 0.))
+
+    # sort by bin and then by value, the medians are then found at the middle of each bin's run
+    order = numpy.lexsort((binned_values, index))
+    sorted_values = binned_values[order]
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    filled = counts > 0
+    median = numpy.full(bins, numpy.nan)
+    lower = sorted_values[starts[filled] + (counts[filled] - 1) // 2]
+    upper = sorted_values[starts[filled] + counts[filled] // 2]
+    median[filled] = (lower + upper) / 2.
+
+    return FoldedCurve((edges[1:] + edges[:-1]) / 2., counts, mean, median, scatter)
+
+
+class RunningFold(object):
+    # accumulates binned sums of a growing light curve; samples are only folded once, unless the
+    # ephemeris or the normalization changes
+    def __init__(self, bins=DEFAULT_BINS):
+        self.bins = bins
+        self.ephemeris = None
+        self.sums = numpy.zeros(bins)
+        self.counts = numpy.zeros(bins)
+        self.folded = 0
+
+    def update(self, time, values, period, epoch, norm):
+        if self.ephemeris != (period, epoch, norm) or len(time) < self.folded:
+            self.ephemeris = (period, epoch, norm)
+            self.sums[:] = 0.
+            self.counts[:] = 0.
+            self.folded = 0
+        offsets, _ = fold_ephemeris(time[self.folded:], period, epoch)
+        index = numpy.clip(((offsets / period + 0.5) * self.bins).astype(int), 0, self.bins - 1)
+        self.sums += numpy.bincount(index, 100. * values[self.folded:] / norm, minlength=self.bins)
+        self.counts += numpy.bincount(index, minlength=self.bins)
+        self.folded = len(time)
+
+    def get_curve(self):
+        period = self.ephemeris[0] if self.ephemeris is not None else 1.
+        centers = (numpy.arange(self.bins) + 0.5) / self.bins * period - period / 2.
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return centers, self.sums / self.counts
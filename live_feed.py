@@ -0,0 +1,213 @@
+# live_feed.py
+# Live photometry feed from transit_cam to other processes through shared memory. transit_cam
+# publishes every sample (timestamp, frame index and the channel sums of each ROI) into a ring
+# buffer; any number of readers attach to it by name and copy the new samples as NumPy arrays.
+# There is a single producer and no lock: the producer announces the record it starts writing,
+# writes it, then advances the count of complete records. A reader copies the records between
+# its position and that count and checks the announced record afterwards; records the producer
+# may have overwritten in the meantime are dropped and reported as lost, just as records that
+# were overwritten before the reader came by. When the producer restarts the feed under the same
+# name, e.g. because the number of channels changed, it marks the old segment as closed and the
+# readers attach to the new one, which has a different generation.
+
+import time
+from argparse import ArgumentParser
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+
+DEFAULT_NAME = 'transit_cam'
+DEFAULT_CAPACITY = 4096
+FEED_MAGIC = 0x7472616e73697431
+FEED_VERSION = 2
+# count is the number of complete records, writing the number of records started
+HEADER = numpy.dtype([('magic', '<u8'), ('version', '<i8'), ('capacity', '<i8'), ('rois', '<i8'),
+                      ('channels', '<i8'), ('count', '<i8'), ('writing', '<i8'), ('generation', '<i8'),
+                      ('closed', '<i8')])
+HEADER_SIZE = 128
+
+
+def get_record_dtype(rois, channels):
+    return numpy.dtype([('sequence', '<i8'), ('timestamp', '<M8[us]'), ('frame', '<i8'),
+                        ('sums', '<f8', (rois, channels))])
+
+
+class LiveFeedError(Exception):
+    pass
+
+
+# names of the feeds published by this process
+published = set()
+
+
+class LiveFeedPublisher(object):
+    def __init__(self, name=DEFAULT_NAME, capacity=DEFAULT_CAPACITY, rois=1, channels=3):
+        # the creation time tells the feeds published under the same name apart
+        generation = time.time_ns()
+        record_dtype = get_record_dtype(rois, channels)
+        size = HEADER_SIZE + capacity * record_dtype.itemsize
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # it may belong to another running producer, so it is never removed here
+            raise LiveFeedError('A live feed named {0} exists already. If no other transit_cam uses it, it was left '
+                                'behind and can be removed with: live_feed.py --remove -n {0}'.format(name))
+        published.add(name)
+        self.name = name
+        self.header = numpy.ndarray((), HEADER, self.memory.buf)
+        self.records = numpy.ndarray((capacity,), record_dtype, self.memory.buf, HEADER_SIZE)
+        self.records['sequence'] = -1
+        self.header['count'] = 0
+        self.header['writing'] = 0
+        self.header['capacity'] = capacity
+        self.header['rois'] = rois
+        self.header['channels'] = channels
+        self.header['generation'] = generation
+        self.header['closed'] = 0
+        self.header['version'] = FEED_VERSION
+        # written last, readers only attach to a complete header
+        self.header['magic'] = FEED_MAGIC
+        self.count = 0
+        self.capacity = capacity
+        self.channels = channels
+        self.generation = generation
+
+    def publish(self, timestamp, sums, frame):
+        self.header['writing'] = self.count + 1
+        record = self.records[self.count % self.capacity]
+        record['sequence'] = -1
+        record['timestamp'] = numpy.datetime64(timestamp, 'us')
+        record['frame'] = frame
+        record['sums'] = sums
+        record['sequence'] = self.count
+        self.count += 1
+        self.header['count'] = self.count
+
+    def close(self):
+        # readers still attached see that the feed ended
+        self.header['closed'] = 1
+        del self.header, self.records
+        self.memory.close()
+        self.memory.unlink()
+        published.discard(self.name)
+
+
+def attach(name):
+    # attaches without registering the memory with the resource tracker of this process, which
+    # would otherwise remove it when the reader exits
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        if name not in published:
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
+
+
+class LiveFeedReader(object):
+    def __init__(self, name=DEFAULT_NAME, from_start=False):
+        self.name = name
+        self.open(from_start)
+        self.lost = 0
+
+    def open(self, from_start):
+        self.memory = attach(self.name)
+        self.header = numpy.ndarray((), HEADER, self.memory.buf)
+        if int(self.header['magic']) != FEED_MAGIC or int(self.header['version']) != FEED_VERSION:
+            self.close()
+            raise LiveFeedError('{} is not a live feed of this version'.format(self.name))
+        self.generation = int(self.header['generation'])
+        self.capacity = int(self.header['capacity'])
+        self.rois = int(self.header['rois'])
+        self.channels = int(self.header['channels'])
+        self.records = numpy.ndarray((self.capacity,), get_record_dtype(self.rois, self.channels),
+                                     self.memory.buf, HEADER_SIZE)
+        # the sequence number of the next record to read
+        count = int(self.header['count'])
+        self.position = max(count - self.capacity, 0) if from_start else count
+
+    def reopen(self):
+        # attaches to the feed that replaced a closed one, returns False while there is none yet
+        try:
+            memory = attach(self.name)
+        except FileNotFoundError:
+            return False
+        header = numpy.ndarray((), HEADER, memory.buf)
+        replaced = int(header['magic']) == FEED_MAGIC and int(header['generation']) != self.generation
+        del header
+        memory.close()
+        if replaced:
+            self.close()
+            # the records of the new feed are all new to this reader
+            self.open(True)
+        return replaced
+
+    def read(self):
+        # returns the new records in order and the number of records lost since the last call; the
+        # records of a restarted feed may have a different number of channels, see self.channels
+        if int(self.header['closed']):
+            records, lost = self.read_records()
+            if len(records) == 0 and self.reopen():
+                return self.read_records()
+            return records, lost
+        return self.read_records()
+
+    def read_records(self):
+        count = int(self.header['count'])
+        first = max(self.position, count - self.capacity)
+        lost = first - self.position
+        slots = numpy.arange(first, count) % self.capacity
+        records = self.records[slots]
+        # records overwritten while they were copied are only detected after the copy
+        overwritten = int(self.header['writing']) - self.capacity
+        valid = (records['sequence'] == numpy.arange(first, count)) & (records['sequence'] >= overwritten)
+        if not numpy.all(valid):
+            skipped = numpy.flatnonzero(~valid)[-1] + 1
+            lost += skipped
+            records = records[skipped:]
+        self.position = count
+        self.lost += lost
+        return records, lost
+
+    def close(self):
+        del self.header
+        if hasattr(self, 'records'):
+            del self.records
+        self.memory.close()
+
+
+def main():
+    parser = ArgumentParser(description='Print the samples published by a running transit_cam')
+    parser.add_argument('-n', '--name', default=DEFAULT_NAME, help='name of the shared memory')
+    parser.add_argument('-i', '--interval', type=float, default=0.5, help='seconds between reads')
+    parser.add_argument('--remove', action='store_true',
+                        help='remove a feed left behind by a transit_cam that did not exit cleanly')
+    args = parser.parse_args()
+
+    if args.remove:
+        try:
+            memory = shared_memory.SharedMemory(args.name)
+        except FileNotFoundError:
+            print('There is no live feed named {}'.format(args.name))
+            return
+        memory.close()
+        memory.unlink()
+        return
+
+    reader = LiveFeedReader(args.name)
+    try:
+        while True:
+            records, lost = reader.read()
+            if lost:
+                print(f'{lost} samples lost')
+            for record in records:
+                print(record['timestamp'], record['frame'], record['sums'].tolist())
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+# log_index.py
+# Sidecar index of the acquisitions in a transit_cam log. For every block starting with a
+# '# New acquisition' line the index keeps its byte offset and length, the number of samples and
+# the timestamp of the first sample, so readers can seek directly to the acquisitions they need.
+# transit_cam extends the index while logging; for other logs it is rebuilt on demand.
+# Rotated segments compressed with gzip or xz are indexed by their uncompressed offsets.
+
+import os
+import gzip
+import lzma
+import mmap
+from argparse import ArgumentParser
+
+INDEX_SUFFIX = '.idx'
+TIMESTAMP_LENGTH = 26
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.xz': lzma.open}
+
+
+def get_index_filename(filename):
+    return filename + INDEX_SUFFIX
+
+
+def is_compressed(filename):
+    return os.path.splitext(filename)[1] in COMPRESSED_OPENERS
+
+
+def open_log(filename, mode='rb'):
+    # opens plain and compressed logs alike, compressed ones are decompressed while reading
+    return COMPRESSED_OPENERS.get(os.path.splitext(filename)[1], open)(filename, mode)
+
+
+class AcquisitionEntry(object):
+    def __init__(self, offset, length, count, first_timestamp=None):
+        self.offset = offset
+        self.length = length
+        self.count = count
+        self.first_timestamp = first_timestamp
+
+    def get_end(self):
+        return self.offset + self.length
+
+    def to_line(self):
+        return '{} {} {} {}\n'.format(self.offset, self.length, self.count, self.first_timestamp or '-')
+
+    @staticmethod
+    def from_line(line):
+        parts = line.strip().split(maxsplit=3)
+        if len(parts) != 4:
+            return None
+        return AcquisitionEntry(int(parts[0]), int(parts[1]), int(parts[2]), None if parts[3] == '-' else parts[3])
+
+
+def scan_blocks(buffer, start, size):
+    # every line starting with '#' begins a new block, the block includes that line
+    result = []
+    position = start
+    while position < size:
+        found = buffer.find(b'\n#', position, size)
+        end = size if found < 0 else found + 1
+        block = buffer[position:end]
+        has_header = block[:1] == b'#'
+        # only complete lines count, the last line may still be written
+        count = block.count(b'\n') - (1 if has_header and b'\n' in block else 0)
+        first_timestamp = None
+        if count > 0:
+            first_line = block.find(b'\n') + 1 if has_header else 0
+            first_timestamp = block[first_line:first_line + TIMESTAMP_LENGTH].decode(errors='replace').strip()
+        result.append(AcquisitionEntry(position, end - position, count, first_timestamp))
+        position = end
+    return result
+
+
+class LogIndex(object):
+    def __init__(self, filename, entries=None):
+        self.filename = filename
+        # acquisitions followed by another one, these can not change anymore
+        self.entries = entries if entries is not None else []
+        # the last acquisition of the file, which may still be growing
+        self.tail = None
+
+    def get_end(self):
+        return self.entries[-1].get_end() if len(self.entries) else 0
+
+    def get_acquisitions(self):
+        # all non-empty acquisitions in file order
+        entries = self.entries + ([self.tail] if self.tail is not None else [])
+        return [entry for entry in entries if entry.count > 0]
+
+    @staticmethod
+    def read_entries(filename):
+        index_filename = get_index_filename(filename)
+        if not os.path.isfile(index_filename):
+            return None
+        with open(index_filename) as in_file:
+            entries = [AcquisitionEntry.from_line(line) for line in in_file]
+        if None in entries:
+            return None
+        # the writer and a rebuilding reader may both have added an entry
+        unique_entries = dict((entry.offset, entry) for entry in entries)
+        return [unique_entries[offset] for offset in sorted(unique_entries)]
+
+    def is_valid(self, buffer, size):
+        position = 0
+        for entry in self.entries:
+            if entry.offset != position:
+                return False
+            position = entry.get_end()
+        if position > size:
+            return False
+        return len(self.entries) == 0 or buffer[self.entries[-1].offset:self.entries[-1].offset + 1] == b'#'
+
+    def save(self):
+        # on read-only media or in directories of other users the index is only kept in memory
+        index_filename = get_index_filename(self.filename)
+        try:
+            with open(index_filename + '.tmp', 'w') as out_file:
+                out_file.writelines(entry.to_line() for entry in self.entries)
+            os.replace(index_filename + '.tmp', index_filename)
+        except OSError:
+            if os.path.isfile(index_filename + '.tmp'):
+                try:
+                    os.remove(index_filename + '.tmp')
+                except OSError:
+                    pass
+
+    def update(self):
+        # validates the index against the log and scans only the part of the log after the last entry
+        self.tail = None
+        if is_compressed(self.filename):
+            return self.update_compressed()
+        size = os.path.getsize(self.filename) if os.path.isfile(self.filename) else 0
+        if size == 0:
+            if len(self.entries):
+                self.entries = []
+                self.save()
+            return self
+        with open(self.filename, 'rb') as in_file, mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            changed = False
+            if not self.is_valid(buffer, size):
+                self.entries = []
+                changed = True
+            new_entries = scan_blocks(buffer, self.get_end(), size)
+        if len(new_entries) > 1:
+            self.entries.extend(new_entries[:-1])
+            changed = True
+        if len(new_entries):
+            self.tail = new_entries[-1]
+        if changed:
+            self.save()
+        return self
+
+    def update_compressed(self):
+        # a compressed segment does not change anymore, so an existing index is complete
+        if len(self.entries) == 0 and os.path.isfile(self.filename):
+            with open_log(self.filename) as in_file:
+                content = in_file.read()
+            self.entries = scan_blocks(content, 0, len(content))
+            self.save()
+        return self
+
+    @staticmethod
+    def load(filename):
+        return LogIndex(filename, LogIndex.read_entries(filename)).update()
+
+    def iter_acquisitions(self, entries, decode=True):
+        # yields the text of each entry, mapping only the requested byte ranges into memory. A
+        # compressed segment is decompressed once from its start, so the entries have to be in
+        # file order, seeking back would decompress the segment from the start again.
+        if is_compressed(self.filename):
+            with open_log(self.filename) as in_file:
+                for entry in entries:
+                    in_file.seek(entry.offset)
+                    content = in_file.read(entry.length)
+                    yield content.decode() if decode else content
+        else:
+            with open(self.filename, 'rb') as in_file, \
+                    mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                for entry in entries:
+                    content = buffer[entry.offset:entry.get_end()]
+                    yield content.decode() if decode else content
+
+    def read_acquisitions(self, entries, decode=True):
+        # returns the text of each entry in the given order, reading them in file order
+        order = sorted(range(len(entries)), key=lambda i: entries[i].offset)
+        result = [None] * len(entries)
+        for i, content in zip(order, self.iter_acquisitions([entries[i] for i in order], decode)):
+            result[i] = content
+        return result
+
+
+class LogIndexWriter(object):
+    # extends the index of a log file while transit_cam writes it
+    def __init__(self, filename):
+        self.index = LogIndex.load(filename)
+        self.current = self.index.tail
+
+    def get_acquisition_count(self):
+        # the number of non-empty acquisitions in the file, including the current one
+        count = sum(1 for entry in self.index.entries if entry.count > 0)
+        return count + (1 if self.current is not None and self.current.count > 0 else 0)
+
+    def update(self, message, out_file):
+        # has to be called before the message is written
+        if message.startswith('#'):
+            self.finish(out_file)
+            self.current = AcquisitionEntry(out_file.tell(), 0, 0)
+        elif self.current is not None:
+            self.current.count += 1
+            if self.current.count == 1:
+                self.current.first_timestamp = message[:TIMESTAMP_LENGTH].strip()
+
+    def finish(self, out_file):
+        if self.current is None:
+            return
+        self.current.length = out_file.tell() - self.current.offset
+        with open(get_index_filename(self.index.filename), 'a') as index_file:
+            index_file.write(self.current.to_line())
+        self.index.entries.append(self.current)
+        self.current = None
+
+
+def main():
+    parser = ArgumentParser(description='Rebuild the acquisition index of transit_cam logs')
+    parser.add_argument('files', metavar='file', nargs='*', default=['transit_cam.log'], help='log files to index')
+    args = parser.parse_args()
+
+    for filename in args.files:
+        if os.path.isfile(get_index_filename(filename)):
+            os.remove(get_index_filename(filename))
+        index = LogIndex.load(filename)
+        acquisitions = index.get_acquisitions()
+        print(f'{filename}: {len(acquisitions)} acquisitions with {sum(entry.count for entry in acquisitions)} samples')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# log_rotation.py
+# Rotation of the transit_cam log. When a new acquisition starts and the log has reached its size
+# or acquisition limit, the log and its index are renamed to a numbered segment
+# (transit_cam.log.0001, transit_cam.log.0002, ...) and logging continues in a new file. Closed
+# segments are compressed with gzip or xz by a background thread, so capturing does not wait for
+# it. Readers see the segments and the current log as one stream, in the order they were written.
+
+import os
+import re
+import gzip
+import lzma
+import shutil
+import threading
+
+import log_index
+
+COMPRESSION_GZIP = 'gz'
+COMPRESSION_XZ = 'xz'
+COMPRESSION_NONE = 'none'
+COMPRESSIONS = (COMPRESSION_GZIP, COMPRESSION_XZ, COMPRESSION_NONE)
+# gzip level 6 compresses a text log nearly as well as level 9 in a fraction of the time
+GZIP_LEVEL = 6
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def get_segment_filename(filename, number):
+    return '{}.{:04d}'.format(filename, number)
+
+
+def get_segment_pattern(filename):
+    return re.compile(re.escape(os.path.basename(filename)) + r'\.(\d+)(\.gz|\.xz)?$')
+
+
+def find_segments(filename):
+    # number and name of all rotated segments, a compressed segment replaces its uncompressed
+    # original once it is complete
+    directory = os.path.dirname(filename)
+    pattern = get_segment_pattern(filename)
+    segments = dict()
+    for name in os.listdir(directory or '.'):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        number = int(match.group(1))
+        if number not in segments or match.group(2) is not None:
+            segments[number] = os.path.join(directory, name)
+    return segments
+
+
+def get_segments(filename):
+    # all rotated segments in the order they were written, followed by the current log
+    segments = find_segments(filename)
+    result = [segments[number] for number in sorted(segments)]
+    if os.path.isfile(filename):
+        result.append(filename)
+    return result
+
+
+def read_lines(filename):
+    # the text lines of all segments, each segment is only opened when the previous is read
+    for segment in get_segments(filename):
+        with log_index.open_log(segment, 'rt') as in_file:
+            for line in in_file:
+                yield line
+
+
+def get_acquisitions(filename):
+    # the index and the entry of every non-empty acquisition of all segments in file order
+    result = []
+    for segment in get_segments(filename):
+        index = log_index.LogIndex.load(segment)
+        result.extend((index, entry) for entry in index.get_acquisitions())
+    return result
+
+
+def iter_acquisitions(filename, decode=False):
+    # the index, the entry and the text of every non-empty acquisition of all segments in one
+    # forward pass, each compressed segment is decompressed once
+    for segment in get_segments(filename):
+        index = log_index.LogIndex.load(segment)
+        entries = index.get_acquisitions()
+        for entry, content in zip(entries, index.iter_acquisitions(entries, decode)):
+            yield index, entry, content
+
+
+def read_acquisitions(acquisitions, decode=False):
+    # yields the text of each (index, entry) pair in the given order, consecutive pairs of the
+    # same segment are read together so a compressed segment is decompressed once for them
+    position = 0
+    while position < len(acquisitions):
+        index = acquisitions[position][0]
+        end = position + 1
+        while end < len(acquisitions) and acquisitions[end][0] is index:
+            end += 1
+        for content in index.read_acquisitions([entry for _, entry in acquisitions[position:end]], decode):
+            yield content
+        position = end
+
+
+def compress_segment(segment, compression):
+    compressed = '{}.{}'.format(segment, compression)
+    opener = gzip.open if compression == COMPRESSION_GZIP else lzma.open
+    options = dict(compresslevel=GZIP_LEVEL) if compression == COMPRESSION_GZIP else dict()
+    with open(segment, 'rb') as in_file, opener(compressed + '.tmp', 'wb', **options) as out_file:
+        shutil.copyfileobj(in_file, out_file, COPY_BUFFER_SIZE)
+    # the offsets of the index refer to the uncompressed data and stay valid, the index has to be
+    # in place before the compressed segment becomes visible to readers
+    index_filename = log_index.get_index_filename(segment)
+    if os.path.isfile(index_filename):
+        shutil.copyfile(index_filename, log_index.get_index_filename(compressed))
+    os.replace(compressed + '.tmp', compressed)
+    os.remove(segment)
+    if os.path.isfile(index_filename):
+        os.remove(index_filename)
+
+
+class LogRotator(object):
+    def __init__(self, filename, max_size=0, max_acquisitions=0, compression=COMPRESSION_GZIP):
+        # a limit of 0 disables rotation for that limit
+        self.filename = filename
+        self.max_size = max_size
+        self.max_acquisitions = max_acquisitions
+        self.compression = compression
+        self.threads = []
+
+    def needs_rotation(self, size, acquisitions):
+        return (0 < self.max_size <= size) or (0 < self.max_acquisitions <= acquisitions)
+
+    def rotate(self):
+        # has to be called after the log is closed
+        if not os.path.isfile(self.filename) or os.path.getsize(self.filename) == 0:
+            return None
+        segments = find_segments(self.filename)
+        segment = get_segment_filename(self.filename, max(segments, default=0) + 1)
+        index_filename = log_index.get_index_filename(self.filename)
+        if os.path.isfile(index_filename):
+            os.replace(index_filename, log_index.get_index_filename(segment))
+        os.replace(self.filename, segment)
+        self.compress([segment])
+        return segment
+
+    def compress(self, segments):
+        if self.compression == COMPRESSION_NONE or len(segments) == 0:
+            return
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        thread = threading.Thread(target=self.compress_segments, args=(segments,), name='log compression')
+        thread.start()
+        self.threads.append(thread)
+
+    def compress_segments(self, segments):
+        for segment in segments:
+            try:
+                compress_segment(segment, self.compression)
+            except OSError as error:
+                print('Compressing {} failed: {}'.format(segment, error))
+
+    def compress_pending(self):
+        # segments left uncompressed by an interrupted session
+        segments = find_segments(self.filename)
+        self.compress([segments[number] for number in sorted(segments)
+                       if not log_index.is_compressed(segments[number])])
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
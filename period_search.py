@@ -0,0 +1,123 @@
+# period_search.py
+# Box Least Squares (BLS) period search for light curves recorded by transit_cam.
+# All trial periods of a block are folded and binned at once, the in-transit sums for
+# every trial duration and phase are then read from cumulative sums over the phase bins.
+
+import numpy
+
+DEFAULT_PERIOD_COUNT = 2000
+# trial durations as fractions of the period
+DEFAULT_DURATIONS = (0.02, 0.03, 0.05, 0.08, 0.12, 0.18, 0.25)
+DEFAULT_PHASE_BINS = 200
+# longer light curves are averaged onto a time grid with this many points before the search
+MAX_SAMPLES = 20000
+# number of (period, sample) pairs folded at once, bounds the memory used per block
+BLOCK_SIZE = 2 ** 22
+
+
+class PeriodSearchResult(object):
+    def __init__(self, periods, power, period, depth, epoch, duration):
+        self.periods = periods
+        self.power = power
+        self.period = period
+        self.depth = depth
+        self.epoch = epoch
+        self.duration = duration
+
+    def get_transit_times(self, from_time, to_time):
+        first = self.epoch + numpy.ceil((from_time - self.epoch) / self.period) * self.period
+        return numpy.arange(first, to_time, self.period)
+
+
+def period_grid(time, min_period=None, max_period=None, count=DEFAULT_PERIOD_COUNT):
+    span = numpy.ptp(time)
+    if max_period is None:
+        # at least two transits have to be covered
+        max_period = span / 2.
+    if min_period is None:
+        min_period = max(20. * numpy.median(numpy.diff(numpy.sort(time))), max_period / 100.)
+    # uniform in frequency, so that the phase drift over the span is the same between neighbours
+    return numpy.sort(1. / numpy.linspace(1. / max_period, 1. / min_period, count))
+
+
+def bin_time_series(time, values, bin_width):
+    index = ((time - time[0]) / bin_width).astype(numpy.intp)
+    counts = numpy.bincount(index)
+    used = counts > 0
+    counts = counts[used]
+    return (numpy.bincount(index, time)[used] / counts,
+            numpy.bincount(index, values)[used] / counts,
+            counts.astype(float))
+
+
+def bls(time, values, periods=None, durations=DEFAULT_DURATIONS, phase_bins=DEFAULT_PHASE_BINS,
+        max_samples=MAX_SAMPLES):
+    time = numpy.asarray(time, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    finite = numpy.isfinite(time) & numpy.isfinite(values)
+    time, values = time[finite], values[finite]
+    if periods is None:
+        periods = period_grid(time)
+    periods = numpy.asarray(periods, dtype=float)
+
+    if len(time) > max_samples:
+        time, values, weights = bin_time_series(time, values, numpy.ptp(time) / max_samples)
+    else:
+        weights = numpy.ones(len(time))
+    weights /= weights.sum()
+    # weighted residuals, so that the in-transit sum of a window directly gives the BLS signal
+    residuals = weights * (values - weights @ values)
+    time_offset = time - time[0]
+
+    duration_bins = numpy.unique(numpy.clip(numpy.round(numpy.asarray(durations) * phase_bins).astype(int),
+                                            1, phase_bins // 2))
+    max_duration_bins = duration_bins[-1]
+
+    power = numpy.zeros(len(periods))
+    best_position = numpy.zeros(len(periods), dtype=int)
+    best_duration = numpy.zeros(len(periods), dtype=int)
+    best_signal = numpy.zeros(len(periods))
+    best_weight = numpy.zeros(len(periods))
+
+    block = max(1, BLOCK_SIZE // len(time))
+    for start in range(0, len(periods), block):
+        block_periods = periods[start:start + block]
+        count = len(block_periods)
+        bins = numpy.minimum((time_offset / block_periods[:, numpy.newaxis] % 1. * phase_bins).astype(numpy.intp),
+                             phase_bins - 1)
+        bins += numpy.arange(count)[:, numpy.newaxis] * phase_bins
+        signal_binned = numpy.bincount(bins.ravel(), numpy.tile(residuals, count),
+                                       minlength=count * phase_bins).reshape(count, phase_bins)
+        weight_binned = numpy.bincount(bins.ravel(), numpy.tile(weights, count),
+                                       minlength=count * phase_bins).reshape(count, phase_bins)
+        # append the first bins again, so that windows wrapping around phase 0 are covered
+        zero_column = numpy.zeros((count, 1))
+        signal_sum = numpy.cumsum(numpy.hstack((zero_column, signal_binned,
+                                                signal_binned[:, :max_duration_bins])), axis=1)
+        weight_sum = numpy.cumsum(numpy.hstack((zero_column, weight_binned,
+                                                weight_binned[:, :max_duration_bins])), axis=1)
+
+        rows = numpy.arange(count)
+        block_slice = slice(start, start + count)
+        for duration in duration_bins:
+            signal = signal_sum[:, duration:duration + phase_bins] - signal_sum[:, :phase_bins]
+            weight = weight_sum[:, duration:duration + phase_bins] - weight_sum[:, :phase_bins]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                # only dips in brightness count
+                candidate = numpy.where((weight > 0.) & (weight < 1.) & (signal < 0.),
+                                        signal ** 2 / (weight * (1. - weight)), 0.)
+            position = numpy.argmax(candidate, axis=1)
+            value = candidate[rows, position]
+            better = value > power[block_slice]
+            power[block_slice] = numpy.where(better, value, power[block_slice])
+            best_position[block_slice] = numpy.where(better, position, best_position[block_slice])
+            best_duration[block_slice] = numpy.where(better, duration, best_duration[block_slice])
+            best_signal[block_slice] = numpy.where(better, signal[rows, position], best_signal[block_slice])
+            best_weight[block_slice] = numpy.where(better, weight[rows, position], best_weight[block_slice])
+
+    best = numpy.argmax(power)
+    period = periods[best]
+    depth = -best_signal[best] / (best_weight[best] * (1. - best_weight[best]))
+    epoch = time[0] + (best_position[best] + best_duration[best] / 2.) / phase_bins * period % period
+    duration = best_duration[best] / phase_bins * period
+    return PeriodSearchResult(periods, power, period, depth, epoch, duration)
@@ -0,0 +1,82 @@
+# profiling.py
+# Time and memory used by the stages of the analysis. Each stage is a with block; the profiler
+# adds up its wall time over all calls and keeps the largest peak of the memory allocated
+# through Python (tracemalloc) during a call. Stages are not nested, the peak is reset at the
+# start of each one. A disabled profiler does nothing, so it can be passed by default.
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageStatistics(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.
+        self.peak_bytes = 0
+
+    def to_json(self):
+        return dict(name=self.name, calls=self.calls, seconds=self.seconds, peak_bytes=self.peak_bytes)
+
+
+class Profiler(object):
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # statistics of the stages in the order they first ran
+        self.stages = dict()
+        self.started_tracing = False
+
+    def start(self):
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        if name not in self.stages:
+            self.stages[name] = StageStatistics(name)
+        statistics = self.stages[name]
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            statistics.seconds += time.perf_counter() - start
+            statistics.calls += 1
+            if tracing:
+                statistics.peak_bytes = max(statistics.peak_bytes, tracemalloc.get_traced_memory()[1] - start_memory)
+
+    def get_total_seconds(self):
+        return sum(statistics.seconds for statistics in self.stages.values())
+
+    def report(self):
+        total = self.get_total_seconds()
+        width = max([len(name) for name in self.stages] + [5])
+        print('{:{}s} {:>6s} {:>10s} {:>6s} {:>12s}'.format('stage', width, 'calls', 'seconds', '%', 'peak MiB'))
+        for statistics in self.stages.values():
+            print('{:{}s} {:6d} {:10.4f} {:6.1f} {:12.2f}'.format(
+                statistics.name, width, statistics.calls, statistics.seconds,
+                100. * statistics.seconds / total if total > 0. else 0., statistics.peak_bytes / 2 ** 20))
+        print('{:{}s} {:6s} {:10.4f}'.format('total', width, '', total))
+
+    def write_json(self, filename):
+        with open(filename, 'w') as out_file:
+            json.dump(dict(total_seconds=self.get_total_seconds(),
+                           stages=[statistics.to_json() for statistics in self.stages.values()]), out_file, indent=2)
+
+
+# used as default argument where profiling is optional
+DISABLED = Profiler(enabled=False)
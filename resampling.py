@@ -0,0 +1,84 @@
+# resampling.py
+# Cadence checks and uniform resampling of light curves. The frame intervals of transit_cam vary
+# with the frame rate limit, the camera exposure and the system load, and dropped frames leave
+# gaps. The nominal cadence is the median frame interval; intervals longer than a multiple of it
+# are gaps. Resampling interpolates the samples onto a grid with the nominal cadence and marks
+# the grid points inside gaps, so methods that expect evenly spaced samples can use the arrays.
+
+import numpy
+
+# intervals longer than this many nominal cadences are gaps
+DEFAULT_GAP_FACTOR = 3.
+# scales the median absolute deviation to the standard deviation of normally distributed values
+MAD_TO_SIGMA = 1.4826
+
+
+class CadenceReport(object):
+    def __init__(self, cadence, jitter, gap_starts, gap_durations, missing):
+        self.cadence = cadence
+        # robust standard deviation of the frame intervals outside gaps
+        self.jitter = jitter
+        self.gap_starts = gap_starts
+        self.gap_durations = gap_durations
+        # the number of frames that would have been taken during the gaps at the nominal cadence
+        self.missing = missing
+
+    def get_gap_count(self):
+        return len(self.gap_starts)
+
+    def __str__(self):
+        return ('Cadence {:.4f} s, jitter {:.4f} s, {} gaps with {} missing frames'
+                .format(self.cadence, self.jitter, self.get_gap_count(), self.missing))
+
+
+class ResampledCurve(object):
+    def __init__(self, time, values, mask, report):
+        self.time = time
+        self.values = values
+        # False for grid points inside a gap, their values are interpolated across the gap
+        self.mask = mask
+        self.report = report
+
+    def get_valid(self):
+        return self.time[self.mask], self.values[self.mask]
+
+
+def fill_gaps(time, values, mask):
+    # replaces the values where mask is False by interpolating the others, so the samples stay on their grid
+    values = numpy.array(values, dtype=float)
+    if numpy.any(mask) and not numpy.all(mask):
+        values[~mask] = numpy.interp(time[~mask], time[mask], values[mask])
+    return values
+
+
+def check_cadence(time, gap_factor=DEFAULT_GAP_FACTOR):
+    time = numpy.asarray(time, dtype=float)
+    intervals = numpy.diff(time)
+    if len(intervals) == 0:
+        return CadenceReport(numpy.nan, numpy.nan, numpy.empty(0), numpy.empty(0), 0)
+    cadence = float(numpy.median(intervals))
+    gaps = intervals > gap_factor * cadence
+    regular = intervals[~gaps]
+    jitter = MAD_TO_SIGMA * float(numpy.median(numpy.abs(regular - numpy.median(regular)))) if len(regular) else 0.
+    missing = int(numpy.sum(numpy.round(intervals[gaps] / cadence) - 1)) if cadence > 0. else 0
+    return CadenceReport(cadence, jitter, time[:-1][gaps], intervals[gaps], missing)
+
+
+def resample(time, values, cadence=None, gap_factor=DEFAULT_GAP_FACTOR):
+    # values may have one column per channel, each is interpolated separately
+    time = numpy.asarray(time, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    report = check_cadence(time, gap_factor)
+    if cadence is None:
+        cadence = report.cadence
+    if len(time) < 2 or not cadence > 0.:
+        return ResampledCurve(time, values, numpy.ones(len(time), dtype=bool), report)
+    grid = time[0] + cadence * numpy.arange(int(numpy.floor((time[-1] - time[0]) / cadence)) + 1)
+    if values.ndim == 1:
+        resampled = numpy.interp(grid, time, values)
+    else:
+        resampled = numpy.column_stack([numpy.interp(grid, time, column) for column in values.T])
+    # a grid point is inside a gap if the samples on both sides of it are a gap apart
+    right = numpy.clip(numpy.searchsorted(time, grid, side='right'), 1, len(time) - 1)
+    mask = (time[right] - time[right - 1]) <= gap_factor * report.cadence
+    return ResampledCurve(grid, resampled, mask, report)
@@ -0,0 +1,69 @@
+# result_cache.py
+# On-disk cache of analysis results. Entries are addressed by a hash of the raw bytes of an
+# acquisition and of the analysis parameters, so a result is reused whenever the same data is
+# analyzed the same way, independent of the file it is read from. Each entry is a NumPy .npz
+# file; when the cache grows beyond its size limit, the least recently used entries are removed.
+
+import os
+import hashlib
+
+import numpy
+
+DEFAULT_DIRECTORY = '.transit_cache'
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# increment when the stored results change, so older entries are no longer used
+CACHE_VERSION = 3
+CACHE_SUFFIX = '.npz'
+
+
+class ResultCache(object):
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(content, parameters):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr((CACHE_VERSION, sorted(parameters.items()))).encode())
+        digest.update(content)
+        return digest.hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        filename = self.get_filename(key)
+        try:
+            with numpy.load(filename) as entry:
+                result = dict(entry)
+        except (OSError, ValueError, EOFError):
+            return None
+        # the modification time marks the last use for the eviction
+        os.utime(filename)
+        return result
+
+    def put(self, key, **arrays):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.get_filename(key)
+        # written under a temporary name, so readers never see a partial entry
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'wb') as out_file:
+            numpy.savez(out_file, **arrays)
+        os.replace(temporary_filename, filename)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_SUFFIX):
+                status = entry.stat()
+                entries.append((status.st_mtime, status.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            total_size -= size
@@ -1,6 +1,12 @@
 import pygame
 import os
+import time
 import yaml
+import numpy
+import datetime
+import collections
+from argparse import ArgumentParser
+from functools import lru_cache
 from math import sin, pi
 
 # define some colors
@@ -23,6 +29,21 @@ YAML_LEFT = 'Left'
 YAML_TOP = 'Top'
 YAML_WIDTH = 'Width'
 YAML_HEIGHT = 'Height'
+YAML_LIMB_DARKENING = 'Limb Darkening'
+YAML_LIMB_DARKENING_COEFFICIENTS = 'Limb Darkening Coefficients'
+
+# coefficients u_k of the limb darkening law I(mu) / I(1) = 1 - sum_k u_k (1 - mu)^k, where mu is the
+# cosine of the angle between the line of sight and the normal of the stellar surface; one coefficient
+# is the linear law, two the quadratic law. These are roughly those of the Sun in visible light.
+DEFAULT_LIMB_DARKENING_COEFFICIENTS = (0.4, 0.25)
+# number of star textures kept, enough for the sizes passed while resizing the star
+TEXTURE_CACHE_SIZE = 16
+
+DEFAULT_REFRESH_RATE = 60
+# number of frame intervals the pacing statistics are computed over
+PACING_WINDOW = 600
+# the last part of the wait for a frame is spent polling the clock, sleeping is not precise enough
+SPIN_NS = 1000000
 
 CONFIG_FILE = 'star_generator.yaml'
 
@@ -130,6 +151,8 @@ class SimStatus(object):
         self.spot_visible = False
         self.amplitude = 20
         self.period = 1000
+        self.limb_darkening = True
+        self.limb_darkening_coefficients = DEFAULT_LIMB_DARKENING_COEFFICIENTS
 
     @property
     def screen(self):
@@ -155,6 +178,8 @@ class SimStatus(object):
             YAML_PULSATING: self.pulsating,
             YAML_SPOT_VISIBLE: self.spot_visible,
             YAML_PERIOD: self.period,
+            YAML_LIMB_DARKENING: self.limb_darkening,
+            YAML_LIMB_DARKENING_COEFFICIENTS: list(self.limb_darkening_coefficients),
         }
 
     @staticmethod
@@ -165,6 +190,9 @@ class SimStatus(object):
         result.pulsating = yaml_node.get(YAML_PULSATING, result.pulsating)
         result.spot_visible = yaml_node.get(YAML_SPOT_VISIBLE, result.spot_visible)
         result.period = yaml_node.get(YAML_PERIOD, result.period)
+        result.limb_darkening = yaml_node.get(YAML_LIMB_DARKENING, result.limb_darkening)
+        result.limb_darkening_coefficients = tuple(
+            yaml_node.get(YAML_LIMB_DARKENING_COEFFICIENTS, result.limb_darkening_coefficients))
         if YAML_STAR in yaml_node.keys():
             result.star = Rect.from_yaml(yaml_node[YAML_STAR])
         if YAML_SPOT in yaml_node.keys():
@@ -216,6 +244,11 @@ class SimStatus(object):
         self.pulsating = not self.pulsating
         self.save_state()
 
+    def toggle_limb_darkening(self):
+        print('Toggling limb darkening')
+        self.limb_darkening = not self.limb_darkening
+        self.save_state()
+
     def toggle_spot(self):
         print('Toggling pulsation')
         self.spot_visible = not self.spot_visible
@@ -420,6 +453,10 @@ class SimStatus(object):
         elif self.pressed_keys.get(pygame.K_s, None) == 0:
             self.toggle_spot()
             del self.pressed_keys[pygame.K_s]
+        # if pressed 'l', toggle limb darkening
+        elif self.pressed_keys.get(pygame.K_l, None) == 0:
+            self.toggle_limb_darkening()
+            del self.pressed_keys[pygame.K_l]
 
     def clear_screen(self, color):
         self.screen.fill(color)
@@ -433,14 +470,24 @@ class SimStatus(object):
         else:
             rect = self.star
             spot = self.spot
-        pygame.draw.ellipse(self.screen, WHITE, rect)
+        if self.limb_darkening:
+            if rect.width > 0 and rect.height > 0:
+                self.screen.blit(self.get_star_texture(rect.size), rect)
+        else:
+            pygame.draw.ellipse(self.screen, WHITE, rect)
         if self.spot_visible:
             pygame.draw.ellipse(self.screen, BLACK, spot)
 
+    def get_star_texture(self, size):
+        # the texture is computed for the size of the star and only rescaled while pulsating
+        texture = star_texture(self.star.width, self.star.height, tuple(self.limb_darkening_coefficients))
+        if texture.get_size() == tuple(size):
+            return texture
+        return pygame.transform.smoothscale(texture, size)
+
     @staticmethod
     def sine_rect(base_rect, amplitudes, time, period):
         ratio = 0.5 * sin(2 * pi * time / period)
-        print(time, ratio)
         return Rect(
             base_rect.left - amplitudes[0] * ratio,
             base_rect.top - amplitudes[1] * ratio,
@@ -456,7 +503,109 @@ class SimStatus(object):
         self.spot.top = self.star.top + spot_offset[1]
 
 
+class PhaseClock(object):
+    # the pulsation is scheduled by frame index at the target refresh rate instead of the time a
+    # frame happens to be drawn, so the displayed sine wave does not pick up frame timing jitter.
+    # A frame presented late advances the index by the refresh periods that passed, which keeps
+    # the phase on the grid of refresh times and counts the missed frames.
+    def __init__(self, refresh_rate=DEFAULT_REFRESH_RATE, window=PACING_WINDOW, log_filename=None):
+        self.refresh_rate = refresh_rate
+        self.frame_period_ns = int(round(1e9 / refresh_rate))
+        self.frame_index = 0
+        self.frames = 0
+        self.missed = 0
+        self.intervals = collections.deque(maxlen=window)
+        self.last_presentation = None
+        # the wall clock time of the frames is derived from perf_counter_ns, like transit_cam does
+        self.start_counter = time.perf_counter_ns()
+        self.start_time = datetime.datetime.now()
+        self.log_file = None
+        if log_filename is not None:
+            self.log_file = open(log_filename, 'w')
+            self.log_file.write('# frame presented pulsation_time_ms phase interval_ms\n')
+
+    def get_time(self):
+        # the pulsation time in milliseconds of the frame to draw
+        return self.frame_index * self.frame_period_ns / 1e6
+
+    def presented(self, period):
+        # has to be called right after the frame is shown
+        now = time.perf_counter_ns()
+        interval = None
+        step = 1
+        if self.last_presentation is not None:
+            interval = now - self.last_presentation
+            self.intervals.append(interval)
+            step = max(1, int(round(interval / self.frame_period_ns)))
+            self.missed += step - 1
+        if self.log_file is not None:
+            timestamp = self.start_time + datetime.timedelta(microseconds=(now - self.start_counter) // 1000)
+            self.log_file.write('{} {} {:.3f} {:.6f} {}\n'.format(
+                self.frame_index, timestamp, self.get_time(), (self.get_time() / period) % 1.,
+                '-' if interval is None else '{:.3f}'.format(interval / 1e6)))
+        self.last_presentation = now
+        self.frames += 1
+        self.frame_index += step
+
+    def wait(self):
+        # waits until the frame index is due, frames are scheduled from the start so the errors
+        # of single waits do not accumulate
+        deadline = self.start_counter + self.frame_index * self.frame_period_ns
+        remaining = deadline - time.perf_counter_ns()
+        if remaining > SPIN_NS:
+            time.sleep((remaining - SPIN_NS) / 1e9)
+        while time.perf_counter_ns() < deadline:
+            pass
+
+    def get_statistics(self):
+        # mean interval, jitter (standard deviation) and longest interval in milliseconds over the
+        # window, and the frames missed in the window
+        if len(self.intervals) == 0:
+            return numpy.nan, numpy.nan, numpy.nan, 0
+        intervals = numpy.array(self.intervals) / 1e6
+        missed = int(numpy.sum(numpy.maximum(numpy.round(intervals * 1e6 / self.frame_period_ns) - 1, 0)))
+        return intervals.mean(), intervals.std(), intervals.max(), missed
+
+    def report(self):
+        mean, jitter, longest, missed = self.get_statistics()
+        print('Frame interval {:.3f} ms (target {:.3f} ms), jitter {:.3f} ms, longest {:.3f} ms, '
+              '{} of the last {} frames missed, {} of {} in total'.format(
+                  mean, self.frame_period_ns / 1e6, jitter, longest, missed, len(self.intervals), self.missed,
+                  self.frames))
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+
+@lru_cache(maxsize=TEXTURE_CACHE_SIZE)
+def star_texture(width, height, coefficients):
+    # intensity of the stellar disk at the center of every pixel, black outside the disk
+    x = ((numpy.arange(width) + 0.5) / width * 2. - 1.)[:, numpy.newaxis]
+    y = ((numpy.arange(height) + 0.5) / height * 2. - 1.)[numpy.newaxis, :]
+    radius_squared = x ** 2 + y ** 2
+    inside = radius_squared <= 1.
+    one_minus_mu = 1. - numpy.sqrt(numpy.clip(1. - radius_squared, 0., 1.))
+    intensity = numpy.ones((width, height))
+    for power, coefficient in enumerate(coefficients, 1):
+        intensity -= coefficient * one_minus_mu ** power
+    intensity = numpy.where(inside, numpy.clip(intensity, 0., 1.), 0.)
+    texture = pygame.Surface((width, height), depth=32)
+    pixels = pygame.surfarray.pixels3d(texture)
+    pixels[...] = numpy.round(255. * intensity)[:, :, numpy.newaxis].astype(numpy.uint8)
+    del pixels
+    return texture
+
+
 def main():
+    parser = ArgumentParser(description='Show a star with an optional spot, pulsation and limb darkening')
+    parser.add_argument('-r', '--refresh_rate', type=float, default=DEFAULT_REFRESH_RATE,
+                        help='frame rate the pulsation is scheduled for')
+    parser.add_argument('-l', '--frame_log', default=None, metavar='FILE',
+                        help='write frame index, presentation time and pulsation phase of every frame')
+    args = parser.parse_args()
+
     # init pygame
     pygame.init()
 
@@ -471,7 +620,7 @@ def main():
     pygame.display.set_caption("star_generator")
 
     # init the clock
-    clock = pygame.time.Clock()
+    phase_clock = PhaseClock(args.refresh_rate, log_filename=args.frame_log)
 
     # main loop    
     while not sim_status.done:
@@ -491,14 +640,19 @@ def main():
         sim_status.handle_key_event(None, None, False)
 
         # draw the star
-        sim_status.draw_star(pygame.time.get_ticks())
+        sim_status.draw_star(phase_clock.get_time())
 
         # update the screen
         pygame.display.flip()
+        phase_clock.presented(sim_status.period)
+        if phase_clock.frames % PACING_WINDOW == 0:
+            phase_clock.report()
 
         # wait
-        clock.tick(60)
+        phase_clock.wait()
 
+    phase_clock.report()
+    phase_clock.close()
     pygame.quit()
 
 
@@ -0,0 +1,34 @@
+# test_detrending.py
+# Compares the running statistics of detrending.py with numpy.median over every window.
+
+import numpy
+import pytest
+
+import detrending
+
+
+def naive_running_median(values, window):
+    half = window // 2
+    padded = numpy.pad(values, half, mode='reflect')
+    return numpy.array([numpy.median(padded[i:i + window]) for i in range(len(values))])
+
+
+@pytest.mark.parametrize('window', [1, 2, 5, 8, 51])
+def test_running_median(window):
+    values = numpy.random.default_rng(1).normal(100., 2., 500)
+    # repeated values have to be removed from the sorted window one at a time
+    values[100:140] = 100.
+    numpy.testing.assert_allclose(detrending.running_median(values, window), naive_running_median(values, window))
+
+
+def test_running_median_short():
+    values = numpy.array([3., 1., 2.])
+    numpy.testing.assert_allclose(detrending.running_median(values, 51), numpy.full(3, 2.))
+
+
+@pytest.mark.parametrize('window', [1, 2, 7, 50])
+def test_streaming_median(window):
+    values = numpy.random.default_rng(2).integers(0, 20, 400).astype(float)
+    running_median = detrending.RunningMedian(window)
+    for i, value in enumerate(values):
+        assert running_median.add(value) == numpy.median(values[max(i + 1 - window, 0):i + 1])
@@ -0,0 +1,75 @@
+# test_folding.py
+# Compares the vectorized folding and binning of folding.py with loops over the transits and bins.
+
+import numpy
+
+import folding
+
+PERIOD = 4.
+
+
+def naive_fold(time, transit_centers, period):
+    offsets, cycles = [], []
+    for t in time:
+        nearest = int(numpy.argmin(numpy.abs(t - transit_centers)))
+        offset = t - transit_centers[nearest]
+        offsets.append(offset)
+        cycles.append(nearest if -period / 2. <= offset < period / 2. else -1)
+    return numpy.array(offsets), numpy.array(cycles)
+
+
+def make_light_curve(seed=5):
+    rng = numpy.random.default_rng(seed)
+    time = numpy.sort(rng.uniform(0., 30., 2000))
+    values = rng.normal(100., 1., len(time))
+    transit_centers = 1.5 + PERIOD * numpy.arange(7) + rng.normal(0., 0.1, 7)
+    return time, values, transit_centers
+
+
+def test_fold():
+    time, _, transit_centers = make_light_curve()
+    offsets, cycles = folding.fold(time, transit_centers, PERIOD)
+    expected_offsets, expected_cycles = naive_fold(time, transit_centers, PERIOD)
+    numpy.testing.assert_array_equal(cycles, expected_cycles)
+    numpy.testing.assert_allclose(offsets[cycles >= 0], expected_offsets[expected_cycles >= 0])
+
+
+def test_normalize_cycles():
+    time, values, transit_centers = make_light_curve()
+    _, cycles = folding.fold(time, transit_centers, PERIOD)
+    values[10] = numpy.nan
+    normalized = folding.normalize_cycles(values, cycles)
+    for cycle in range(len(transit_centers)):
+        window = values[cycles == cycle]
+        edges = numpy.concatenate((window[:folding.EDGE_SAMPLES], window[-folding.EDGE_SAMPLES:]))
+        numpy.testing.assert_allclose(normalized[cycles == cycle], 100. * window / numpy.nanmean(edges))
+    assert numpy.all(numpy.isnan(normalized[cycles < 0]))
+
+
+def test_bin_folded():
+    time, values, transit_centers = make_light_curve()
+    offsets, _ = folding.fold(time, transit_centers, PERIOD)
+    binned = folding.bin_folded(offsets, values, PERIOD, bins=20)
+    edges = numpy.linspace(-PERIOD / 2., PERIOD / 2., 21)
+    for i in range(20):
+        inside = (offsets >= edges[i]) & (offsets < edges[i + 1])
+        assert binned.counts[i] == numpy.sum(inside)
+        if numpy.any(inside):
+            numpy.testing.assert_allclose(binned.mean[i], numpy.mean(values[inside]))
+            numpy.testing.assert_allclose(binned.median[i], numpy.median(values[inside]))
+            numpy.testing.assert_allclose(binned.scatter[i], numpy.std(values[inside]), atol=1e-6)
+
+
+def test_running_fold():
+    # adding the samples in pieces gives the same curve as adding them at once
+    time, values, _ = make_light_curve()
+    running_fold = folding.RunningFold(bins=25)
+    for end in (300, 301, 1200, len(time)):
+        running_fold.update(time[:end], values[:end], PERIOD, 1.5, 100.)
+    complete = folding.RunningFold(bins=25)
+    complete.update(time, values, PERIOD, 1.5, 100.)
+    numpy.testing.assert_allclose(running_fold.get_curve()[1], complete.get_curve()[1])
+    offsets, _ = folding.fold_ephemeris(time, PERIOD, 1.5)
+    index = numpy.clip(((offsets / PERIOD + 0.5) * 25).astype(int), 0, 24)
+    expected = [numpy.mean(values[index == i]) for i in range(25)]
+    numpy.testing.assert_allclose(complete.get_curve()[1], expected)
@@ -0,0 +1,39 @@
+# test_period_search.py
+# The BLS search of period_search.py has to recover a box-shaped transit injected into noise.
+
+import numpy
+import pytest
+
+import period_search
+
+PERIOD = 7.3
+DEPTH = 2.
+DURATION = 0.6
+EPOCH = 3.1
+
+
+def make_light_curve(samples=3000, span=100., noise=0.2, seed=3):
+    time = numpy.linspace(0., span, samples)
+    values = 100. + numpy.random.default_rng(seed).normal(0., noise, samples)
+    phase = (time - EPOCH + PERIOD / 2.) % PERIOD - PERIOD / 2.
+    values[numpy.abs(phase) < DURATION / 2.] -= DEPTH
+    return time, values
+
+
+def test_bls_recovers_transit():
+    time, values = make_light_curve()
+    result = period_search.bls(time, values)
+    assert result.period == pytest.approx(PERIOD, rel=0.01)
+    assert result.depth == pytest.approx(DEPTH, rel=0.1)
+    transit_times = result.get_transit_times(time[0], time[-1])
+    expected = numpy.arange(EPOCH, time[-1], PERIOD)
+    assert len(transit_times) == len(expected)
+    numpy.testing.assert_allclose(transit_times, expected, atol=DURATION / 2.)
+
+
+def test_bls_binned():
+    # longer light curves are averaged onto a coarser grid first
+    time, values = make_light_curve(samples=30000)
+    result = period_search.bls(time, values, max_samples=5000)
+    assert result.period == pytest.approx(PERIOD, rel=0.01)
+    assert result.depth == pytest.approx(DEPTH, rel=0.1)
@@ -0,0 +1,77 @@
+# test_transit_fit.py
+# The batched fit of transit_fit.py has to recover the parameters of synthetic trapezoid transits.
+
+import numpy
+import pytest
+
+import transit_fit
+
+PERIOD = 10.
+LEVEL = 100.
+DEPTH = 5.
+DURATION = 1.2
+INGRESS = 0.2
+# the true mid-times are shifted against the centers given to the fit
+SHIFTS = numpy.array([0.05, -0.08, 0.02, 0.1, -0.03])
+CENTERS = 5. + PERIOD * numpy.arange(len(SHIFTS))
+
+
+def naive_trapezoid(time, level, depth, mid_time, duration, ingress):
+    distance = abs(time - mid_time)
+    if distance >= duration / 2.:
+        return level
+    if distance <= duration / 2. - ingress:
+        return level - depth
+    return level - depth * (duration / 2. - distance) / ingress
+
+
+def make_light_curve(noise=0.05, seed=4):
+    time = numpy.arange(0., PERIOD * len(SHIFTS), 0.01)
+    values = numpy.full(len(time), LEVEL)
+    for mid_time in CENTERS + SHIFTS:
+        values += numpy.array([naive_trapezoid(t, LEVEL, DEPTH, mid_time, DURATION, INGRESS) - LEVEL
+                               for t in time])
+    return time, values + numpy.random.default_rng(seed).normal(0., noise, len(time))
+
+
+def test_trapezoid():
+    time = numpy.linspace(-1., 1., 201)
+    parameters = numpy.array([[LEVEL, DEPTH, 0.1, DURATION, INGRESS]])
+    expected = [naive_trapezoid(t, LEVEL, DEPTH, 0.1, DURATION, INGRESS) for t in time]
+    numpy.testing.assert_allclose(transit_fit.trapezoid(time[numpy.newaxis, :], parameters)[0], expected)
+
+
+def test_jacobian():
+    # compared with central differences, away from the corners of the trapezoid
+    time = numpy.linspace(-1., 1., 400)[numpy.newaxis, :]
+    parameters = numpy.array([[LEVEL, DEPTH, 0.1, DURATION, INGRESS]])
+    step = 1e-6
+    for i in range(len(transit_fit.PARAMETERS)):
+        delta = numpy.zeros_like(parameters)
+        delta[0, i] = step
+        numeric = (transit_fit.trapezoid(time, parameters + delta) -
+                   transit_fit.trapezoid(time, parameters - delta)) / (2. * step)
+        numpy.testing.assert_allclose(transit_fit.jacobian(time, parameters)[..., i], numeric, atol=1e-4)
+
+
+def test_fit_transits():
+    time, values = make_light_curve()
+    result = transit_fit.fit_transits(time, values, CENTERS, PERIOD)
+    numpy.testing.assert_allclose(result.get_mid_times(), CENTERS + SHIFTS, atol=0.005)
+    numpy.testing.assert_allclose(result.get('depth'), DEPTH, rtol=0.02)
+    numpy.testing.assert_allclose(result.get('duration'), DURATION, rtol=0.02)
+    numpy.testing.assert_allclose(result.get('ingress'), INGRESS, rtol=0.1)
+    depth, error = result.get_mean('depth')
+    assert depth == pytest.approx(DEPTH, abs=5. * error)
+    assert numpy.all(result.get_error('depth') > 0.)
+
+
+def test_fit_transits_invalid_samples():
+    # samples that are not valid must not pull the fit, whatever their values
+    time, values = make_light_curve()
+    valid = numpy.ones(len(time), dtype=bool)
+    valid[::7] = False
+    values[~valid] = 0.
+    result = transit_fit.fit_transits(time, values, CENTERS, PERIOD, valid)
+    numpy.testing.assert_allclose(result.get_mid_times(), CENTERS + SHIFTS, atol=0.005)
+    numpy.testing.assert_allclose(result.get('depth'), DEPTH, rtol=0.02)
@@ -1,7 +1,16 @@
 import os
+import time
 import yaml
+import functools
+import threading
+import collections
+import numpy
 import pygame
 import datetime
+from argparse import ArgumentParser
+import log_index
+import log_rotation
+import live_feed
 import pygame.camera as py_camera
 
 # define some colors
@@ -30,51 +39,191 @@ YAML_HEIGHT = 'height'
 YAML_ROI = 'roi'
 YAML_OUT_FILENAME = 'out_filename'
 YAML_MONOCHROME = 'monochrome'
+YAML_TRACKING = 'tracking'
+YAML_APERTURE = 'aperture'
+YAML_SKY_ANNULUS = 'sky_annulus'
+YAML_ROTATION = 'rotation'
+YAML_MAX_MEGABYTES = 'max_megabytes'
+YAML_MAX_ACQUISITIONS = 'max_acquisitions'
+YAML_COMPRESSION = 'compression'
+YAML_LIVE_FEED = 'live_feed'
+YAML_CAMERAS = 'cameras'
+YAML_DEVICE = 'device'
+
+APERTURE_RECTANGLE = 'rectangle'
+APERTURE_CIRCLE = 'circle'
+APERTURE_ELLIPSE = 'ellipse'
+APERTURES = (APERTURE_RECTANGLE, APERTURE_CIRCLE, APERTURE_ELLIPSE)
+# each pixel is split into n x n sub-pixels to compute its partial weight
+APERTURE_SUPERSAMPLING = 5
+# Rec. 709 weights of the red, green and blue channels in the luminance measured in monochrome mode
+LUMINANCE_WEIGHTS = numpy.array((0.2126, 0.7152, 0.0722), dtype=numpy.float32)
+
+# the search window extends the ROI by this fraction of its size on each side
+TRACKING_MARGIN = 0.5
+# only every n-th pixel in each direction is used for the centroid
+TRACKING_STEP = 2
+# offsets smaller than this (in pixels) are ignored, so the ROI does not jitter
+TRACKING_DEADBAND = 1
+
+# the capture threads take at most this many frames per second from each camera
+MAX_FRAME_RATE = 60
+# seconds a capture thread waits before asking a camera again for a frame
+FRAME_POLL_INTERVAL = 0.002
+
+
+class SessionClock(object):
+    # a monotonic clock shared by all cameras, tied to the wall clock once at the start, so the
+    # timestamps of the cameras can be compared and do not jump when the system time is adjusted
+    def __init__(self):
+        self.start_counter = time.perf_counter_ns()
+        self.start_time = datetime.datetime.now()
+
+    def now(self):
+        return self.start_time + datetime.timedelta(microseconds=(time.perf_counter_ns() - self.start_counter) // 1000)
+
+
+def read_config(filename=CONFIG_FILE):
+    if not os.path.isfile(filename):
+        return dict()
+    with open(filename, 'r') as in_file:
+        return yaml.load(in_file, Loader=yaml.SafeLoader) or dict()
+
+
+def get_default_name(camera_number, name, extension=''):
+    # the first camera keeps the names used with a single camera
+    if camera_number == 0:
+        return name + extension
+    return '{}_{}{}'.format(name, camera_number, extension)
 
 
 class SimStatus(object):
-    def __init__(self, cam_rect, a_plot_rect, screen, a_roi, a_logging, a_last_logging_change=datetime.datetime.now()):
+    def __init__(self, cam_rect, a_plot_rect, screen, a_roi, a_logging, a_last_logging_change=datetime.datetime.now(),
+                 camera_number=0):
         self.cam_rect = cam_rect
         self.plot_rect = a_plot_rect
         self.screen = screen
         self.logging = a_logging
         self.last_logging_change = a_last_logging_change
         self.last_monochrome_change = a_last_logging_change
+        self.last_tracking_change = a_last_logging_change
+        self.last_aperture_change = a_last_logging_change
         self.index = 0
         self.done = False
+        self.camera_number = camera_number
+        # the status of all cameras, which are saved together
+        self.cameras = [self]
+        # held by the capture thread while it processes a frame and by the main loop while it handles keys
+        self.lock = threading.RLock()
+        self.image = None
+        self.pending_sums = collections.deque()
         # saved status
+        self.device = None
         self.roi = a_roi
-        self.out_filename = 'transit_cam.log'
+        self.out_filename = get_default_name(camera_number, 'transit_cam', '.log')
         self.out_file = None
+        self.log_index = None
         self.monochrome = False
+        self.tracking = False
+        self.aperture = APERTURE_RECTANGLE
+        self.sky_annulus = 0
+        # the log is rotated at the start of an acquisition once one of the limits is reached, 0 disables a limit
+        self.max_megabytes = 0
+        self.max_acquisitions = 0
+        self.compression = log_rotation.COMPRESSION_GZIP
+        self.log_rotator = None
+        # every sample is published under this shared memory name, by default there is no feed
+        self.live_feed_name = None
+        # set by the command line for this session only, the feed then uses a default name if none is configured
+        self.live_feed_requested = False
+        # set when the feed could not be created, it stays disabled for this session
+        self.live_feed_failed = False
+        self.live_feed = None
+        self.frame_index = 0
         
     def load_status(self, filename=CONFIG_FILE):
         if not os.path.isfile(filename):
             return
-        with open(filename, 'r') as in_file:
-            self.from_yaml(yaml.load(in_file, Loader=yaml.SafeLoader))
+        yaml_node = read_config(filename)
+        # with several cameras, each has its own section, a single camera uses the whole file
+        if YAML_CAMERAS in yaml_node:
+            sections = yaml_node[YAML_CAMERAS]
+            yaml_node = sections[self.camera_number] if self.camera_number < len(sections) else dict()
+        elif self.camera_number > 0:
+            return
+        self.from_yaml(yaml_node)
             
     def save_status(self):
+        # only called by the main loop; the capture threads take no other lock than their own, so
+        # holding the lock of each camera in turn cannot deadlock with them
+        sections = []
+        for camera in self.cameras:
+            # tracking moves the ROI in the capture thread
+            with camera.lock:
+                sections.append(camera.to_yaml())
+        # the sections of cameras not used in this session are kept
+        sections.extend(read_config().get(YAML_CAMERAS, [])[len(sections):])
+        yaml_node = {YAML_CAMERAS: sections} if len(sections) > 1 else sections[0]
         with open(CONFIG_FILE, 'w') as out:
-            yaml.dump(self.to_yaml(), out, default_flow_style=False)
+            yaml.dump(yaml_node, out, default_flow_style=False)
 
     def to_yaml(self):
-        return {
+        # the ROI is saved relative to the camera image, independent of where that is on the screen
+        result = {
             YAML_OUT_FILENAME: self.out_filename,
-            YAML_ROI: self.rect_to_yaml(self.roi),
-            YAML_MONOCHROME: self.monochrome
+            YAML_ROI: dict(self.rect_to_yaml(self.roi.move(-self.cam_rect.left, -self.cam_rect.top)), **{
+                YAML_APERTURE: self.aperture,
+                YAML_SKY_ANNULUS: self.sky_annulus,
+            }),
+            YAML_MONOCHROME: self.monochrome,
+            YAML_LIVE_FEED: self.live_feed_name,
+            YAML_TRACKING: self.tracking,
+            YAML_ROTATION: {
+                YAML_MAX_MEGABYTES: self.max_megabytes,
+                YAML_MAX_ACQUISITIONS: self.max_acquisitions,
+                YAML_COMPRESSION: self.compression,
+            },
         }
+        if self.device is not None:
+            result[YAML_DEVICE] = self.device
+        return result
         
     def from_yaml(self, yaml_node):
         if YAML_ROI in yaml_node.keys(): 
-            self.roi = self.rect_from_yaml(yaml_node[YAML_ROI])
+            self.roi = self.rect_from_yaml(yaml_node[YAML_ROI]).move(self.cam_rect.left, self.cam_rect.top)
+            self.aperture = yaml_node[YAML_ROI].get(YAML_APERTURE, self.aperture)
+            self.sky_annulus = yaml_node[YAML_ROI].get(YAML_SKY_ANNULUS, self.sky_annulus)
         self.out_filename = yaml_node.get(YAML_OUT_FILENAME, self.out_filename)
         self.monochrome = yaml_node.get(YAML_MONOCHROME, self.monochrome)
+        self.live_feed_name = yaml_node.get(YAML_LIVE_FEED, self.live_feed_name)
+        self.tracking = yaml_node.get(YAML_TRACKING, self.tracking)
+        self.device = yaml_node.get(YAML_DEVICE, self.device)
+        rotation = yaml_node.get(YAML_ROTATION, dict())
+        self.max_megabytes = rotation.get(YAML_MAX_MEGABYTES, self.max_megabytes)
+        self.max_acquisitions = rotation.get(YAML_MAX_ACQUISITIONS, self.max_acquisitions)
+        self.compression = rotation.get(YAML_COMPRESSION, self.compression)
+        if self.compression not in log_rotation.COMPRESSIONS:
+            print('Unknown compression {}, using {}'.format(self.compression, log_rotation.COMPRESSION_GZIP))
+            self.compression = log_rotation.COMPRESSION_GZIP
 
     def toggle_monochrome(self):
         if (datetime.datetime.now() - self.last_monochrome_change).total_seconds() > 1:
             self.last_monochrome_change = datetime.datetime.now()
             self.monochrome = not self.monochrome
+            # the log records change from three channels to one value, so they start a new acquisition
+            self.log(NEW_ACQUISITION)
+            self.save_status()
+
+    def toggle_tracking(self):
+        if (datetime.datetime.now() - self.last_tracking_change).total_seconds() > 1:
+            self.last_tracking_change = datetime.datetime.now()
+            self.tracking = not self.tracking
+            self.save_status()
+
+    def cycle_aperture(self):
+        if (datetime.datetime.now() - self.last_aperture_change).total_seconds() > 1:
+            self.last_aperture_change = datetime.datetime.now()
+            self.aperture = APERTURES[(APERTURES.index(self.aperture) + 1) % len(APERTURES)]
             self.save_status()
 
     def toggle_logging(self):
@@ -84,13 +233,30 @@ class SimStatus(object):
             else:
                 self.begin_log()
     
+    def get_log_rotator(self):
+        if self.log_rotator is None:
+            self.log_rotator = log_rotation.LogRotator(self.out_filename, int(self.max_megabytes * 1024 * 1024),
+                                                       self.max_acquisitions, self.compression)
+            self.log_rotator.compress_pending()
+        return self.log_rotator
+
+    def rotate_log(self):
+        self.log_index.finish(self.out_file)
+        self.out_file.close()
+        self.get_log_rotator().rotate()
+        self.out_file = open(self.out_filename, 'a')
+        self.log_index = log_index.LogIndexWriter(self.out_filename)
+
     def begin_log(self):
         self.out_file = open(self.out_filename, 'a')
+        self.log_index = log_index.LogIndexWriter(self.out_filename)
         self.logging = True
         self.log(NEW_ACQUISITION)
         self.last_logging_change = datetime.datetime.now()
         
     def end_log(self):
+        self.log_index.finish(self.out_file)
+        self.log_index = None
         self.out_file.close()
         self.logging = False
         self.last_logging_change = datetime.datetime.now()
@@ -116,10 +282,106 @@ class SimStatus(object):
     def log(self, message):
         if self.logging:
             if self.out_file is not None: 
+                if message.startswith('#') and self.log_index is not None and self.get_log_rotator().needs_rotation(
+                        self.out_file.tell(), self.log_index.get_acquisition_count()):
+                    self.rotate_log()
+                if self.log_index is not None:
+                    self.log_index.update(message, self.out_file)
                 self.out_file.write(message)
 
-    def draw_roi(self):
-        pygame.draw.rect(self.screen, RED if self.logging else BLUE, self.roi, 1)
+    def get_live_feed_name(self):
+        if self.live_feed_name is None and self.live_feed_requested:
+            return get_default_name(self.camera_number, live_feed.DEFAULT_NAME)
+        return self.live_feed_name
+
+    def publish(self, timestamp, new_sum):
+        # a monochrome sample has one channel, the feed is created again when that changes and the
+        # readers attach to the new one
+        if self.live_feed is not None and self.live_feed.channels != len(new_sum):
+            self.close_live_feed()
+        name = self.get_live_feed_name()
+        if self.live_feed is None and name and not self.live_feed_failed:
+            try:
+                self.live_feed = live_feed.LiveFeedPublisher(name, channels=len(new_sum))
+            except (OSError, live_feed.LiveFeedError) as error:
+                print('Live feed disabled: {}'.format(error))
+                self.live_feed_failed = True
+        if self.live_feed is not None:
+            self.live_feed.publish(timestamp, new_sum, self.frame_index)
+        self.frame_index += 1
+
+    def close_live_feed(self):
+        if self.live_feed is not None:
+            self.live_feed.close()
+            self.live_feed = None
+
+    def get_image_rect(self, image):
+        # the area of the camera image on the screen
+        return pygame.Rect(self.cam_rect.topleft, image.get_size())
+
+    def get_subsurface(self, image, rect):
+        # the part of the camera image below a rectangle given in screen coordinates
+        return image.subsurface(rect.move(-self.cam_rect.left, -self.cam_rect.top))
+
+    def track(self, image):
+        # search around the ROI for the intensity-weighted centroid and move the ROI onto it
+        image_rect = self.get_image_rect(image)
+        search_rect = self.roi.inflate(int(2 * TRACKING_MARGIN * self.roi.width),
+                                       int(2 * TRACKING_MARGIN * self.roi.height)).clip(image_rect)
+        centroid = compute_centroid(self.get_subsurface(image, search_rect))
+        if centroid is None:
+            return 0, 0
+        offset_x = round(search_rect.left + centroid[0] - (self.roi.left + self.roi.width / 2.))
+        offset_y = round(search_rect.top + centroid[1] - (self.roi.top + self.roi.height / 2.))
+        if abs(offset_x) < TRACKING_DEADBAND:
+            offset_x = 0
+        if abs(offset_y) < TRACKING_DEADBAND:
+            offset_y = 0
+        old_left, old_top = self.roi.left, self.roi.top
+        self.roi.move_ip(offset_x, offset_y)
+        self.roi.clamp_ip(image_rect)
+        return self.roi.left - old_left, self.roi.top - old_top
+
+    def get_photometry_rect(self):
+        return self.roi.inflate(2 * self.sky_annulus, 2 * self.sky_annulus)
+
+    def compute_photometry(self, image):
+        window = self.get_photometry_rect()
+        clipped = window.clip(self.get_image_rect(image))
+        weights = aperture_weights(self.aperture, self.roi.width, self.roi.height, self.sky_annulus)
+        # near the border of the camera image only part of the sky annulus is available
+        weights = weights[:, clipped.left - window.left:clipped.right - window.left,
+                          clipped.top - window.top:clipped.bottom - window.top]
+        if self.monochrome:
+            return compute_luminance(self.get_subsurface(image, clipped), weights)
+        return compute_sum(self.get_subsurface(image, clipped), weights)
+
+    def process_frame(self, image, timestamp):
+        # runs in the capture thread of the camera, the main loop only draws the results
+        if self.tracking:
+            offset = self.track(image)
+        new_sum = self.compute_photometry(image)
+        # a monochrome record has a single column with the luminance
+        values = new_sum[0] if self.monochrome else new_sum
+        # the fraction of the seconds is always written, so every timestamp has the same length
+        text_timestamp = timestamp.isoformat(' ', 'microseconds')
+        if self.tracking:
+            self.log('{} {} {}\n'.format(text_timestamp, values, offset))
+        else:
+            self.log('{} {}\n'.format(text_timestamp, values))
+        self.publish(timestamp, new_sum)
+        self.pending_sums.append(new_sum)
+        self.image = image
+
+    def draw_roi(self, width=1):
+        color = RED if self.logging else BLUE
+        pygame.draw.rect(self.screen, color, self.roi, width)
+        if self.aperture == APERTURE_CIRCLE:
+            pygame.draw.circle(self.screen, color, self.roi.center, min(self.roi.size) // 2, width)
+        elif self.aperture == APERTURE_ELLIPSE:
+            pygame.draw.ellipse(self.screen, color, self.roi, width)
+        if self.sky_annulus > 0:
+            pygame.draw.rect(self.screen, color, self.get_photometry_rect(), width)
         
     def move_top(self, increment):
         self.roi.top += increment
@@ -153,10 +415,17 @@ class SimStatus(object):
             self.roi.width = (self.cam_rect.right - self.roi.left)
         self.save_status()
 
+    def place(self, left, size):
+        # puts the camera image at left on the screen, the ROI moves along with it
+        self.roi.move_ip(left - self.cam_rect.left, 0)
+        self.cam_rect.left = left
+        self.cam_rect.size = size
+
     def update_regions(self, new_size):
         self.plot_rect.top = self.cam_rect.bottom
         self.plot_rect.left = self.cam_rect.left
-        self.plot_rect.width = new_size[0]
+        # with several cameras, each plots below its own image
+        self.plot_rect.width = new_size[0] if len(self.cameras) == 1 else self.cam_rect.width
         self.plot_rect.height = new_size[1] - self.plot_rect.top
         
     def increment_index(self, increment=1):
@@ -167,12 +436,13 @@ class SimStatus(object):
     def draw_sum(self, new_sum):
         # print(new_sum)
         scaled = [(255. - value) * self.plot_rect.height / 255. for value in new_sum]
+        x = self.plot_rect.left + self.index
         if self.monochrome:
-            pygame.draw.rect(self.screen, BLACK, [self.index, plot_rect.top + sum(scaled) / 3, 1, 2])
+            pygame.draw.rect(self.screen, BLACK, [x, self.plot_rect.top + sum(scaled) / len(scaled), 1, 2])
         else:
-            pygame.draw.rect(self.screen, RED, [self.index, plot_rect.top + scaled[0], 1, 2])
-            pygame.draw.rect(self.screen, GREEN, [self.index, plot_rect.top + scaled[1], 1, 2])
-            pygame.draw.rect(self.screen, BLUE, [self.index, plot_rect.top + scaled[2], 1, 2])    
+            pygame.draw.rect(self.screen, RED, [x, self.plot_rect.top + scaled[0], 1, 2])
+            pygame.draw.rect(self.screen, GREEN, [x, self.plot_rect.top + scaled[1], 1, 2])
+            pygame.draw.rect(self.screen, BLUE, [x, self.plot_rect.top + scaled[2], 1, 2])    
 
 
 def handle_key_event(key, value, sim_status):
@@ -192,6 +462,12 @@ def handle_key_event(key, value, sim_status):
     elif key == pygame.K_m:
         sim_status.toggle_monochrome()
         return True 
+    elif key == pygame.K_t:
+        sim_status.toggle_tracking()
+        return True 
+    elif key == pygame.K_a:
+        sim_status.cycle_aperture()
+        return True 
     elif key == pygame.K_RCTRL or key == pygame.K_LCTRL or key == pygame.K_LSHIFT or key == pygame.K_RSHIFT:
         return True
     # handle arrow keys
@@ -222,32 +498,149 @@ def handle_key_event(key, value, sim_status):
     return False
 
 
-def compute_sum(surface):
-    pixel_array = pygame.PixelArray(surface)
-    rect = pixel_array.shape
-    num_pixels = rect[0] * rect[1]
-    r_sum, g_sum, b_sum = (0., 0., 0.)
-    for x in range(rect[0]):
-        for y in range(rect[1]):
-            value = pixel_array[x, y]
-            r_sum += (value & 0xFF0000) / 0x10000
-            g_sum += (value & 0x00FF00) / 0x100
-            b_sum += value & 0x0000FF
-    return r_sum/num_pixels, g_sum/num_pixels, b_sum/num_pixels
+@functools.lru_cache(maxsize=8)
+def aperture_weights(aperture, width, height, sky_annulus=0):
+    # returns the aperture and sky annulus weights stacked as an array of shape (2, width, height),
+    # both for a window that extends the ROI by sky_annulus pixels on each side
+    size_x, size_y = width + 2 * sky_annulus, height + 2 * sky_annulus
+    step = APERTURE_SUPERSAMPLING
+    x = ((numpy.arange(size_x * step) + 0.5) / step - size_x / 2.)[:, numpy.newaxis]
+    y = ((numpy.arange(size_y * step) + 0.5) / step - size_y / 2.)[numpy.newaxis, :]
+    if aperture == APERTURE_CIRCLE:
+        radius = min(width, height) / 2.
+        inside = x ** 2 + y ** 2 <= radius ** 2
+        inside_sky = x ** 2 + y ** 2 <= (radius + sky_annulus) ** 2
+    elif aperture == APERTURE_ELLIPSE:
+        inside = (x / (width / 2.)) ** 2 + (y / (height / 2.)) ** 2 <= 1.
+        inside_sky = (x / (width / 2. + sky_annulus)) ** 2 + (y / (height / 2. + sky_annulus)) ** 2 <= 1.
+    else:
+        inside = (abs(x) <= width / 2.) & (abs(y) <= height / 2.)
+        inside_sky = (abs(x) <= size_x / 2.) & (abs(y) <= size_y / 2.)
+    masks = numpy.stack((inside, inside_sky & ~inside)).astype(numpy.float32)
+    weights = masks.reshape(2, size_x, step, size_y, step).mean(axis=(2, 4))
+    weights.flags.writeable = False
+    return weights
+
+
+def compute_sum(surface, weights=None):
+    pixels = pygame.surfarray.pixels3d(surface)
+    if weights is None:
+        weights = numpy.ones((1,) + pixels.shape[:2], dtype=numpy.float32)
+    # a single dot product yields the weighted sums of all channels for the aperture and the sky
+    sums = numpy.tensordot(weights, pixels, axes=2)
+    del pixels
+    totals = weights.sum(axis=(1, 2))
+    means = sums[0] / totals[0]
+    if len(totals) > 1 and totals[1] > 0.:
+        means -= sums[1] / totals[1]
+    return tuple(float(value) for value in means)
+
+
+def compute_luminance(surface, weights=None):
+    # like compute_sum, but the channels are combined to the luminance, returned as a tuple of one value
+    pixels = pygame.surfarray.pixels3d(surface)
+    if weights is None:
+        weights = numpy.ones((1,) + pixels.shape[:2], dtype=numpy.float32)
+    sums = numpy.tensordot(weights, pixels, axes=2) @ LUMINANCE_WEIGHTS
+    del pixels
+    totals = weights.sum(axis=(1, 2))
+    luminance = sums[0] / totals[0]
+    if len(totals) > 1 and totals[1] > 0.:
+        luminance -= sums[1] / totals[1]
+    return (float(luminance),)
+
+
+def compute_centroid(surface, step=TRACKING_STEP):
+    # work on a strided view of the pixels, so only every step-th row and column is read
+    pixels = pygame.surfarray.pixels3d(surface)
+    intensity = pixels[::step, ::step].sum(axis=2, dtype=numpy.float32)
+    del pixels
+    # only pixels brighter than the average of the window contribute
+    intensity -= intensity.mean()
+    numpy.clip(intensity, 0., None, out=intensity)
+    total = intensity.sum()
+    if total <= 0.:
+        return None
+    x_positions = numpy.arange(intensity.shape[0], dtype=numpy.float32) * step + (step - 1) / 2.
+    y_positions = numpy.arange(intensity.shape[1], dtype=numpy.float32) * step + (step - 1) / 2.
+    return (float(intensity.sum(axis=1) @ x_positions / total),
+            float(intensity.sum(axis=0) @ y_positions / total))
+
+
+def get_camera_count(filename=CONFIG_FILE):
+    # the number of cameras with a section in the configuration
+    return max(len(read_config(filename).get(YAML_CAMERAS, [])), 1)
+
+
+def capture(camera, sim_status, session_clock, stop):
+    # each camera is read and measured in its own thread, so it keeps its frame rate independent of
+    # the other cameras and of the screen updates
+    clock = pygame.time.Clock()
+    while not stop.is_set():
+        if not camera.query_image():
+            time.sleep(FRAME_POLL_INTERVAL)
+            continue
+        img = camera.get_image()
+        timestamp = session_clock.now()
+        with sim_status.lock:
+            sim_status.process_frame(img, timestamp)
+        # leaves the lock free for the main loop between frames
+        clock.tick(MAX_FRAME_RATE)
 
 
 def main():
+    parser = ArgumentParser(description='Measure the brightness of a region of one or more cameras')
+    parser.add_argument('-c', '--cameras', type=int, default=None,
+                        help='number of cameras to use, by default the number configured in ' + CONFIG_FILE)
+    parser.add_argument('-f', '--live_feed', action='store_true',
+                        help='publish the samples in shared memory for live_feed.py and other readers, '
+                             'also enabled by a live_feed name in ' + CONFIG_FILE)
+    args = parser.parse_args()
+
     pygame.init() 
     py_camera.init(None)
-    for camera in py_camera.list_cameras():
-        print(camera)
-    camera = py_camera.Camera(py_camera.list_cameras()[0])
-    camera.start()
+    # a device may be listed more than once, it can only be opened once
+    devices = list(dict.fromkeys(py_camera.list_cameras()))
+    for device in devices:
+        print(device)
+    camera_count = min(args.cameras or get_camera_count(), len(devices))
+    if camera_count == 0:
+        print('No camera found')
+        pygame.quit()
+        return
+
+    sim_statuses = []
+    for camera_number in range(camera_count):
+        if camera_number == 0:
+            sim_status = SimStatus(CAM_RECT, plot_rect, None, roi, logging, datetime.datetime.now())
+        else:
+            sim_status = SimStatus(pygame.Rect(CAM_RECT), pygame.Rect(plot_rect), None, pygame.Rect(roi), logging,
+                                   datetime.datetime.now(), camera_number)
+        sim_status.cameras = sim_statuses
+        sim_status.load_status()
+        sim_status.live_feed_requested = args.live_feed
+        sim_statuses.append(sim_status)
+
+    cameras = []
+    left = 0
+    for sim_status in sim_statuses:
+        # a device that is missing or already used by another camera is replaced by an unused one
+        used = [other.device for other in sim_statuses[:sim_status.camera_number]]
+        if sim_status.device not in devices or sim_status.device in used:
+            sim_status.device = [device for device in devices if device not in used][0]
+        camera = py_camera.Camera(sim_status.device)
+        camera.start()
+        cameras.append(camera)
+        # the camera images are placed side by side
+        sim_status.place(left, camera.get_size())
+        left = sim_status.cam_rect.right
     
     # create the screen
-    size = DEFAULT_SIZE
+    size = (max(DEFAULT_SIZE[0], left), DEFAULT_SIZE[1])
     screen = pygame.display.set_mode(size, pygame.RESIZABLE)
-    regions_updated = False
+    for sim_status in sim_statuses:
+        sim_status.screen = screen
+        sim_status.update_regions(size)
     
     pygame.display.set_caption("transit_cam")
     
@@ -255,15 +648,22 @@ def main():
     clock = pygame.time.Clock()
     
     pressed_keys = dict()
-    
-    sim_status = SimStatus(CAM_RECT, plot_rect, screen, roi, logging, datetime.datetime.now())
-    sim_status.load_status()
+    # keys act on the selected camera, the number keys select one
+    selected = 0
 
     # Clear the screen
     screen.fill(WHITE)
+
+    session_clock = SessionClock()
+    stop = threading.Event()
+    threads = [threading.Thread(target=capture, args=(camera, sim_status, session_clock, stop),
+                                name='capture {}'.format(sim_status.camera_number), daemon=True)
+               for camera, sim_status in zip(cameras, sim_statuses)]
+    for thread in threads:
+        thread.start()
     
     # ----------- Main program loop -----------
-    while not sim_status.done:
+    while not any(sim_status.done for sim_status in sim_statuses):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 print("User asked to quit")
@@ -272,7 +672,9 @@ def main():
                 screen = pygame.display.set_mode(event.size, pygame.RESIZABLE)
                 size = screen.get_size()
                 print(size)
-                sim_status.update_regions(size)
+                for sim_status in sim_statuses:
+                    sim_status.screen = screen
+                    sim_status.update_regions(size)
                 # Clear the screen
                 screen.fill(WHITE)
             elif event.type == pygame.KEYDOWN:
@@ -282,40 +684,49 @@ def main():
 #                 print("User released a key")
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 print("User pressed a mouse button")
-          
-        # --- App logic
-        img = camera.get_image()
-        timestamp = datetime.datetime.now()
-        if not regions_updated:
-            sim_status.cam_rect.width = img.get_size()[0]
-            sim_status.cam_rect.height = img.get_size()[1]
-            sim_status.update_regions(size)
-            regions_updated = True
         
         # respond to pressed keys
+        sim_status = sim_statuses[selected]
         for key, value in pressed_keys.items():
-            if handle_key_event(key, value, sim_status):
+            if pygame.K_1 <= key <= pygame.K_9:
+                selected = min(key - pygame.K_1, len(sim_statuses) - 1)
                 continue
-            # if an unhandled key is pressed, acquisition is reset                
-            screen.fill(WHITE)
-            sim_status.index = 0
-            sim_status.log(NEW_ACQUISITION) 
+            with sim_status.lock:
+                if handle_key_event(key, value, sim_status):
+                    continue
+                # if an unhandled key is pressed, acquisition is reset                
+                screen.fill(WHITE)
+                sim_status.index = 0
+                sim_status.log(NEW_ACQUISITION) 
 
         # --- Drawing code
-        screen.blit(img, sim_status.cam_rect)
-        subsurface = screen.subsurface(sim_status.roi)
-        new_sum = compute_sum(subsurface)
-        sim_status.log('{} {}\n'.format(timestamp, new_sum))
-        sim_status.draw_roi()
-        sim_status.draw_sum(new_sum)
-        
-        sim_status.increment_index()
+        for sim_status in sim_statuses:
+            with sim_status.lock:
+                if sim_status.image is None:
+                    continue
+                screen.blit(sim_status.image, sim_status.cam_rect)
+                sim_status.draw_roi(2 if sim_status.camera_number == selected and len(sim_statuses) > 1 else 1)
+                # all samples measured since the last screen update
+                while len(sim_status.pending_sums):
+                    sim_status.draw_sum(sim_status.pending_sums.popleft())
+                    sim_status.increment_index()
         
         # --- update the screen
         pygame.display.flip()
         
         clock.tick(60) 
     
+    stop.set()
+    for thread, camera in zip(threads, cameras):
+        thread.join()
+        camera.stop()
+    for sim_status in sim_statuses:
+        if sim_status.logging:
+            sim_status.end_log()
+        if sim_status.log_rotator is not None:
+            # finish compressing the rotated segments
+            sim_status.log_rotator.join()
+        sim_status.close_live_feed()
     pygame.quit()
 
 
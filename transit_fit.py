@@ -0,0 +1,170 @@
+# transit_fit.py
+# Fits a trapezoid transit model (out-of-transit level, depth, mid-time, total duration and
+# ingress duration) to every transit of a light curve. All transits are stacked into one padded
+# array and fitted together with a batched Levenberg-Marquardt iteration, each transit keeping
+# its own damping. Uncertainties are taken from the covariance matrix at the solution.
+
+import numpy
+import folding
+
+PARAMETERS = ('level', 'depth', 'mid_time', 'duration', 'ingress')
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-10
+# the ingress may not be shorter than this fraction of the duration
+MIN_INGRESS = 1e-3
+
+
+class TransitFitResult(object):
+    def __init__(self, transit_centers, parameters, errors, chi2, counts):
+        # transit_centers are the times the mid_time parameters are relative to
+        self.transit_centers = transit_centers
+        self.parameters = parameters
+        self.errors = errors
+        self.chi2 = chi2
+        self.counts = counts
+
+    def get(self, name):
+        return self.parameters[:, PARAMETERS.index(name)]
+
+    def get_error(self, name):
+        return self.errors[:, PARAMETERS.index(name)]
+
+    def get_mid_times(self):
+        return self.transit_centers + self.get('mid_time')
+
+    def get_mean(self, name):
+        # inverse-variance weighted mean over the transits and its uncertainty
+        errors = self.get_error(name)
+        used = numpy.isfinite(errors) & (errors > 0.)
+        if not numpy.any(used):
+            return numpy.nanmean(self.get(name)), numpy.nan
+        weights = 1. / errors[used] ** 2
+        return numpy.sum(weights * self.get(name)[used]) / numpy.sum(weights), 1. / numpy.sqrt(numpy.sum(weights))
+
+
+def split_parameters(parameters):
+    return [parameters[:, i, numpy.newaxis] for i in range(len(PARAMETERS))]
+
+
+def trapezoid(time, parameters):
+    # time has shape (transits, samples), parameters (transits, 5)
+    level, depth, mid_time, duration, ingress = split_parameters(parameters)
+    position = (duration / 2. - numpy.abs(time - mid_time)) / ingress
+    return level - depth * numpy.clip(position, 0., 1.)
+
+
+def jacobian(time, parameters):
+    level, depth, mid_time, duration, ingress = split_parameters(parameters)
+    position = (duration / 2. - numpy.abs(time - mid_time)) / ingress
+    shape = numpy.clip(position, 0., 1.)
+    # the shape only depends on the timing parameters during ingress and egress
+    ramp = ((position > 0.) & (position < 1.)) / ingress
+    result = numpy.empty(time.shape + (len(PARAMETERS),))
+    result[..., 0] = 1.
+    result[..., 1] = -shape
+    result[..., 2] = -depth * ramp * numpy.sign(time - mid_time)
+    result[..., 3] = -depth * ramp / 2.
+    result[..., 4] = depth * ramp * position
+    return result
+
+
+def stack_transits(time, values, transit_centers, period, valid=None):
+    # returns the samples of each transit window as padded arrays of shape (transits, samples),
+    # the mask of the valid entries and the center of each window; samples where valid is False
+    # stay in the windows but are masked
+    offsets, cycles = folding.fold(time, transit_centers, period)
+    if valid is not None:
+        # the samples that are not valid are also left out of the normalization
+        values = numpy.where(valid, values, numpy.nan)
+    normalized = folding.normalize_cycles(values, cycles)
+    used = cycles >= 0
+    counts = numpy.bincount(cycles[used], minlength=len(transit_centers))
+    starts, _ = folding.get_cycle_ranges(cycles)
+    filled = numpy.flatnonzero(counts[:len(starts)] > 0)
+    counts, starts = counts[filled], starts[filled]
+    steps = numpy.arange(counts.max() if len(counts) else 0)
+    mask = steps < counts[:, numpy.newaxis]
+    index = numpy.where(mask, starts[:, numpy.newaxis] + steps, 0)
+    if valid is not None:
+        mask &= numpy.asarray(valid, dtype=bool)[index]
+    centers = numpy.sort(numpy.asarray(transit_centers, dtype=float))[filled]
+    return offsets[index], numpy.where(mask, normalized[index], numpy.nan), mask, centers
+
+
+def constrain(parameters, cadence):
+    parameters[:, 1] = numpy.maximum(parameters[:, 1], 0.)
+    parameters[:, 3] = numpy.maximum(parameters[:, 3], 2. * cadence)
+    parameters[:, 4] = numpy.clip(parameters[:, 4], MIN_INGRESS * parameters[:, 3], parameters[:, 3] / 2.)
+    return parameters
+
+
+def initial_parameters(time, values, mask):
+    level = numpy.nanpercentile(values, 75., axis=1)
+    depth = level - numpy.nanpercentile(values, 2., axis=1)
+    below = mask & (values < (level - depth / 2.)[:, numpy.newaxis])
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cadence = numpy.nanmedian(numpy.where(mask[:, 1:] & mask[:, :-1], numpy.diff(time, axis=1), numpy.nan), axis=1)
+        mid_time = numpy.where(below.any(axis=1),
+                               numpy.sum(numpy.where(below, time, 0.), axis=1) / below.sum(axis=1), 0.)
+    half_width = numpy.maximum(below.sum(axis=1), 1) * cadence
+    return numpy.stack((level, depth, mid_time, 1.25 * half_width, 0.25 * half_width), axis=1), cadence
+
+
+def fit_transits(time, values, transit_centers, period, valid=None):
+    # samples where valid is False, such as the grid points in the gaps of a resampled light curve, get no weight
+    time, values, mask, centers = stack_transits(numpy.asarray(time, dtype=float),
+                                                 numpy.asarray(values, dtype=float), transit_centers, period, valid)
+    if len(centers) == 0:
+        empty = numpy.empty((0, len(PARAMETERS)))
+        return TransitFitResult(centers, empty, empty, numpy.empty(0), numpy.empty(0, dtype=int))
+    values = numpy.where(mask, values, 0.)
+    weights = mask.astype(float)
+    parameters, cadence = initial_parameters(time, numpy.where(mask, values, numpy.nan), mask)
+    parameters = constrain(parameters, cadence)
+    model = trapezoid(time, parameters)
+    chi2 = numpy.sum(weights * (values - model) ** 2, axis=1)
+    damping = numpy.full(len(centers), 1e-3)
+    identity = numpy.eye(len(PARAMETERS))
+
+    # the iteration only continues with the transits that have not converged, their rows are the
+    # working arrays and active holds their index
+    active = numpy.arange(len(centers))
+    work_time, work_values, work_weights, work_cadence = time, values, weights, cadence
+    work_parameters, work_model, work_chi2 = parameters.copy(), model, chi2
+    for iteration in range(MAX_ITERATIONS):
+        derivatives = jacobian(work_time, work_parameters) * work_weights[..., numpy.newaxis]
+        residuals = work_weights * (work_values - work_model)
+        # batched matrix products are much faster than the equivalent einsum
+        transposed = derivatives.transpose(0, 2, 1)
+        normal = transposed @ derivatives
+        gradient = (transposed @ residuals[..., numpy.newaxis])[..., 0]
+        damped = normal + damping[:, numpy.newaxis, numpy.newaxis] * (normal * identity + 1e-12 * identity)
+        step = numpy.linalg.solve(damped, gradient[..., numpy.newaxis])[..., 0]
+        trial = constrain(work_parameters + step, work_cadence)
+        trial_model = trapezoid(work_time, trial)
+        trial_chi2 = numpy.sum(work_weights * (work_values - trial_model) ** 2, axis=1)
+        better = trial_chi2 < work_chi2
+        improvement = numpy.where(better, (work_chi2 - trial_chi2) / numpy.maximum(work_chi2, numpy.finfo(float).tiny),
+                                  0.)
+        work_parameters[better] = trial[better]
+        work_model[better] = trial_model[better]
+        work_chi2 = numpy.where(better, trial_chi2, work_chi2)
+        damping = numpy.clip(numpy.where(better, damping / 10., damping * 10.), 1e-9, 1e9)
+        converged = (improvement < TOLERANCE) & (better | (damping >= 1e3))
+        parameters[active], chi2[active] = work_parameters, work_chi2
+        if numpy.all(converged):
+            break
+        if numpy.any(converged):
+            keep = ~converged
+            active, damping, work_cadence = active[keep], damping[keep], work_cadence[keep]
+            work_time, work_values, work_weights = work_time[keep], work_values[keep], work_weights[keep]
+            work_parameters, work_model, work_chi2 = work_parameters[keep], work_model[keep], work_chi2[keep]
+
+    derivatives = jacobian(time, parameters) * weights[..., numpy.newaxis]
+    normal = numpy.einsum('nmi,nmj->nij', derivatives, derivatives)
+    counts = mask.sum(axis=1)
+    variance = chi2 / numpy.maximum(counts - len(PARAMETERS), 1)
+    with numpy.errstate(invalid='ignore'):
+        covariance = numpy.linalg.pinv(normal) * variance[:, numpy.newaxis, numpy.newaxis]
+        errors = numpy.sqrt(numpy.diagonal(covariance, axis1=1, axis2=2))
+    return TransitFitResult(centers, parameters, errors, chi2, counts)
@@ -0,0 +1,137 @@
+# transit_timing.py
+# Transit timing analysis across acquisitions and log files: the transit mid-times of every
+# acquisition are collected on an absolute time axis, a linear ephemeris (epoch and period) is
+# fitted to all of them in one least squares solve, and the observed minus computed (O-C)
+# residuals are plotted per transit.
+
+from argparse import ArgumentParser
+
+import numpy
+
+import MPStransit
+import log_rotation
+import result_cache
+import transit_fit
+from analyze_transit import LightCurve
+
+UNIX_EPOCH = numpy.datetime64('1970-01-01T00:00:00', 'us')
+# the cycle numbers are assigned again with the refined period this many times
+EPHEMERIS_ITERATIONS = 3
+
+
+class EphemerisResult(object):
+    def __init__(self, epoch, period, epoch_error, period_error, cycles, residuals):
+        self.epoch = epoch
+        self.period = period
+        self.epoch_error = epoch_error
+        self.period_error = period_error
+        self.cycles = cycles
+        self.residuals = residuals
+
+
+def analyze_acquisition(content, fit=False, cache=None):
+    # returns the absolute transit mid-times (seconds since 1970) and the period of one acquisition
+    key = result_cache.ResultCache.get_key(content, dict(timing=True, fit=fit))
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return cached['mid_times'], float(cached['period'])
+    light_curves = LightCurve.parse_block(content)
+    result = (numpy.empty(0), numpy.nan)
+    if len(light_curves):
+        light_curve = light_curves[0]
+        times = light_curve.get_times()
+        values = light_curve.values.sum(axis=1)
+        period, depth, transit_centers = MPStransit.lightcurve_analyze(times, values)
+        if fit:
+            transit_centers = transit_fit.fit_transits(times, values, transit_centers, period).get_mid_times()
+        start = (light_curve.timestamps[0] - UNIX_EPOCH) / numpy.timedelta64(1, 's')
+        result = (start + numpy.asarray(transit_centers, dtype=float), period)
+    if cache is not None:
+        cache.put(key, mid_times=result[0], period=result[1])
+    return result
+
+
+def collect_transits(filenames, fit=False, cache=None):
+    # returns all mid-times, the acquisition number of each and the period of each acquisition
+    mid_times = []
+    acquisitions = []
+    periods = []
+    for filename in filenames:
+        for index, entry, content in log_rotation.iter_acquisitions(filename):
+            acquisition_mid_times, period = analyze_acquisition(content, fit, cache)
+            mid_times.append(acquisition_mid_times)
+            acquisitions.append(numpy.full(len(acquisition_mid_times), len(periods)))
+            periods.append(period)
+    if len(mid_times) == 0:
+        return numpy.empty(0), numpy.empty(0, dtype=int), numpy.empty(0)
+    return numpy.concatenate(mid_times), numpy.concatenate(acquisitions), numpy.array(periods)
+
+
+def fit_ephemeris(mid_times, period_guess):
+    # returns None without a usable period guess, the cycles between the transits can not be counted then
+    if not numpy.isfinite(period_guess) or period_guess <= 0.:
+        return None
+    order = numpy.argsort(mid_times)
+    mid_times = numpy.asarray(mid_times, dtype=float)[order]
+    # subtracting the first mid-time keeps the least squares problem well conditioned
+    reference = mid_times[0]
+    relative_times = mid_times - reference
+    period = period_guess
+    for iteration in range(EPHEMERIS_ITERATIONS):
+        # cycles are counted between consecutive transits, so an inaccurate period only matters over
+        # the gaps and not over the whole time span
+        cycles = numpy.concatenate(([0.], numpy.cumsum(numpy.round(numpy.diff(relative_times) / period))))
+        design = numpy.column_stack((numpy.ones(len(cycles)), cycles))
+        (epoch, period), _, _, _ = numpy.linalg.lstsq(design, relative_times, rcond=None)
+    residuals = relative_times - (epoch + period * cycles)
+    variance = residuals @ residuals / max(len(residuals) - 2, 1)
+    covariance = numpy.linalg.pinv(design.T @ design) * variance
+    result_cycles = numpy.empty(len(cycles), dtype=int)
+    result_residuals = numpy.empty(len(cycles))
+    result_cycles[order], result_residuals[order] = cycles.astype(int), residuals
+    return EphemerisResult(reference + epoch, period, numpy.sqrt(covariance[0, 0]), numpy.sqrt(covariance[1, 1]),
+                           result_cycles, result_residuals)
+
+
+def plot_residuals(ephemeris, acquisitions, no_pdf=False):
+    from pylab import figure, subplot, savefig, show
+    fig = figure(2)
+    fig.clf()
+    axis = subplot(111)
+    axis.scatter(ephemeris.cycles, ephemeris.residuals, c=acquisitions, s=4, cmap='viridis')
+    axis.axhline(0., color='black', linewidth=0.5)
+    axis.set_xlabel('Durchgang')
+    axis.set_ylabel('O-C (s)')
+    axis.set_title('T = {:.5f} +/- {:.5f} s'.format(ephemeris.period, ephemeris.period_error))
+    if no_pdf is False:
+        savefig('transit_timing.pdf', format='pdf')
+    show()
+
+
+def main():
+    parser = ArgumentParser(description='Fit a linear ephemeris to the transits of many logs and plot O-C residuals')
+    parser.add_argument('files', metavar='file', nargs='*', default=['transit_cam.log'], help='files to be analyzed')
+    parser.add_argument('-np', '--no_pdf', action='store_true', help='skip PDF export')
+    parser.add_argument('--fit', action='store_true', help='use fitted transit mid-times')
+    parser.add_argument('--no_cache', action='store_true', help='analyze again instead of using cached results')
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else result_cache.ResultCache()
+    mid_times, acquisitions, periods = collect_transits(args.files, args.fit, cache)
+    if len(mid_times) < 2:
+        print('Not enough transits found')
+        return
+    # acquisitions too short for two transits have no period
+    finite_periods = periods[numpy.isfinite(periods)]
+    ephemeris = fit_ephemeris(mid_times, numpy.median(finite_periods) if len(finite_periods) else numpy.nan)
+    if ephemeris is None:
+        print('Not enough transits found, no acquisition yields a period')
+        return
+    print(f'{len(mid_times)} transits in {len(periods)} acquisitions')
+    print('Period = {:.6f} +/- {:.6f} s'.format(ephemeris.period, ephemeris.period_error))
+    print('RMS of O-C = {:.4f} s'.format(numpy.sqrt(numpy.mean(ephemeris.residuals ** 2))))
+    plot_residuals(ephemeris, acquisitions, args.no_pdf)
+
+
+if __name__ == '__main__':
+    main()